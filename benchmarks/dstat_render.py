@@ -0,0 +1,162 @@
+"""
+Times rendering rows of random values for the default collectors with
+RowRenderer against the per-cell Statistic objects it replaced, a compact
+copy of which is kept here, and checks that both render the same.
+
+    python -m benchmarks.dstat_render [ROWS]
+"""
+
+import random
+import sys
+import time
+
+from psutilz.dstat import (
+    BOLD,
+    DARKGREY,
+    HEAT_COLORS,
+    RESET,
+    CpuTimes,
+    DiskStats,
+    LoadAvgs,
+    MemUsages,
+    NetStats,
+    Paging,
+    RowRenderer,
+)
+
+
+class Statistic:
+    thresholds = ()
+
+    def __init__(self, value, unit="", width=5):
+        self.raw_value = value
+        self.value = value
+        self.unit = unit
+        self.value_width = width - len(unit)
+
+    def heat_level(self):
+        for level, threshold in enumerate(self.thresholds):
+            if self.raw_value < threshold:
+                return level
+        return len(self.thresholds)
+
+    def to_str(self):
+        if self.value == 0:  # int or float
+            value_str = " " * (self.value_width - 1) + "0"
+        elif isinstance(self.value, int):
+            value_str = "% *d" % (self.value_width, self.value)
+        else:
+            value_str = ("%.6f" % self.value)[: self.value_width]
+        return (
+            HEAT_COLORS[self.heat_level()]
+            + BOLD
+            + value_str
+            + RESET
+            + DARKGREY
+            + BOLD
+            + self.unit
+            + RESET
+        )
+
+
+def pretty_bytes(value, b=" "):
+    number = value
+    for unit in [b, "k", "m", "g", "t", "p"]:
+        if number < 1024.0 or unit == "p":
+            break
+        number /= 1024.0
+    return number, unit
+
+
+class LoadAvg(Statistic):
+    thresholds = (0.5, 1, 2, 5)
+
+    def __init__(self, value):
+        super().__init__(value, width=4)
+
+
+class CpuTime(Statistic):
+    thresholds = (5, 15, 35, 70)
+
+    def __init__(self, value):
+        super().__init__(value, width=3)
+
+    def to_str(self):
+        if self.value == 0:
+            return HEAT_COLORS[0] + BOLD + "0.0" + RESET
+        return super().to_str()
+
+
+class ByteStat(Statistic):
+    def __init__(self, value):
+        super().__init__(*pretty_bytes(value))
+        self.raw_value = value
+
+
+class DiskStat(ByteStat):
+    thresholds = (10 * 1024, 200 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+class NetStat(ByteStat):
+    thresholds = (10 * 1024, 100 * 1024, 768 * 1024, 2 * 1024 * 1024)
+
+
+class MemUsage(ByteStat):
+    pass
+
+
+class PagingStat(ByteStat):
+    thresholds = (1024, 10 * 1024, 100 * 1024, 1024 * 1024)
+
+
+COLLECTORS = [
+    (LoadAvgs(), LoadAvg),
+    (CpuTimes(), CpuTime),
+    (DiskStats(), DiskStat),
+    (NetStats(), NetStat),
+    (MemUsages(), MemUsage),
+    (Paging(), PagingStat),
+]
+
+
+def random_row(rng):
+    n_cpu = len(COLLECTORS[1][0].cells)
+    cpu = [rng.choice([0.0, rng.random() * 100]) for _ in range(n_cpu)]
+    return [
+        [rng.random() * 8 for _ in range(3)],
+        cpu,
+        [rng.choice([0, rng.random() * 2**30]) for _ in range(2)],
+        [rng.choice([0, rng.random() * 2**24]) for _ in range(2)],
+        [rng.randint(1, 2**36) for _ in range(2)],
+        [rng.choice([0, rng.randint(1, 2**22)]) for _ in range(2)],
+    ]
+
+
+def render_statistics(row):
+    return RowRenderer.COLUMN_DELIM.join(
+        " ".join(statistic(value).to_str() for value in values)
+        for (_, statistic), values in zip(COLLECTORS, row)
+    )
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(0)
+    rows = [random_row(rng) for _ in range(n)]
+    renderer = RowRenderer([collector.cells for collector, _ in COLLECTORS])
+    for row in rows[:1000]:
+        assert renderer.render(row) == render_statistics(row), row
+
+    for name, render in [
+        ("Statistic.to_str", render_statistics),
+        ("RowRenderer", renderer.render),
+    ]:
+        start = time.perf_counter()
+        for row in rows:
+            render(row)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>16}: {n / elapsed:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Times one tick of Sampler reading every source, with the psutil backend
+and with the procfs backend (linux only), both for all sources and for
+only those that the procfs backend reads itself (process_cpu_times, for
+one, reads every process with psutil either way).
+
+    python -m benchmarks.dstat_sampler [TICKS]
+"""
+
+import sys
+import time
+
+from psutilz.dstat import BACKENDS, SOURCES, ProcfsSources, Sampler
+
+
+def time_ticks(sources, backend, ticks):
+    sampler = Sampler(sources, backend)
+    sampler.sample()  # warm up, e.g. open files
+    start = time.perf_counter()
+    for _ in range(ticks):
+        sampler.sample()
+    return (time.perf_counter() - start) / ticks
+
+
+def main():
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    procfs_sources = [source for source in SOURCES if hasattr(ProcfsSources, source)]
+    for label, sources in [("all", list(SOURCES)), ("procfs", procfs_sources)]:
+        for backend in BACKENDS:
+            if backend == "procfs" and not ProcfsSources.available():
+                print(f"{label} sources, {backend}: not available")
+                continue
+            elapsed = time_ticks(sources, backend, ticks)
+            print(f"{label} sources, {backend}: {elapsed * 1e6:.0f}us per tick")
+
+
+if __name__ == "__main__":
+    main()
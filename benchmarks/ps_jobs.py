@@ -0,0 +1,53 @@
+"""
+Times collect_procs() with the default columns' attributes on the real
+process table for several --jobs values, optionally after starting extra
+sleeping processes to make the table bigger.
+
+    python -m benchmarks.ps_jobs [--extra N] [--jobs 1,2,4,8] [--repeat 3]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+
+from psutilz.ps import DEFAULT_COLUMNS, collect_procs, column_attrs
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument(
+        "--extra", type=int, default=0, help="start this many sleeping processes"
+    )
+    arg_parser.add_argument(
+        "--jobs",
+        type=lambda value: [int(jobs) for jobs in value.split(",")],
+        default=[1, 2, 4, 8],
+        help="comma-separated --jobs values to time",
+    )
+    arg_parser.add_argument(
+        "--repeat", type=int, default=3, help="report the best of this many runs"
+    )
+    args = arg_parser.parse_args()
+
+    attrs = column_attrs(DEFAULT_COLUMNS)
+    sleepers = [
+        subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3600)"])
+        for _ in range(args.extra)
+    ]
+    try:
+        for jobs in args.jobs:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                procs = collect_procs(attrs, jobs=jobs)
+                best = min(best, time.perf_counter() - start)
+            print(f"--jobs {jobs}: {len(procs)} processes in {best * 1000:.1f}ms")
+    finally:
+        for sleeper in sleepers:
+            sleeper.kill()
+            sleeper.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Times print_tree() rendering the default columns of a synthetic process
+table to /dev/null. The table has no deep fork chain by default, since
+the indentation of a chain thousands deep dominates the output.
+
+    python -m benchmarks.ps_render [SIZE]
+"""
+
+import os
+import sys
+import time
+
+from psutilz.ps import build_process_tree, print_tree
+
+from .synthetic import process_table
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    tree = build_process_tree(process_table(n, deep_fraction=0))
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        print_tree(tree, out=devnull)
+        elapsed = time.perf_counter() - start
+    print(f"{n} rows in {elapsed:.2f}s ({n / elapsed:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
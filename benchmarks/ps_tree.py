@@ -0,0 +1,45 @@
+"""
+Times building and walking ps.py's process tree for synthetic process
+tables of 1k, 10k and 100k processes, each with a fork chain a tenth as
+deep, and reports the peak memory allocated while building.
+
+    python -m benchmarks.ps_tree [SIZE ...]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from psutilz.ps import build_process_tree
+
+from .synthetic import process_table
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1000, 10000, 100000]
+    print("%8s %10s %10s %12s" % ("procs", "build", "walk", "peak memory"))
+    for n in sizes:
+        procs = process_table(n)
+
+        start = time.perf_counter()
+        tree = build_process_tree(procs)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        walked = sum(1 for _ in tree.walk())
+        walk_time = time.perf_counter() - start
+        assert walked == n
+
+        tracemalloc.start()
+        build_process_tree(procs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            "%8d %9.1fms %9.1fms %10.1fMB"
+            % (n, build_time * 1000, walk_time * 1000, peak / 2**20)
+        )
+
+
+if __name__ == "__main__":
+    main()
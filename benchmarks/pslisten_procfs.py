@@ -0,0 +1,102 @@
+"""
+Compares pslisten's /proc/net fast path with the psutil path it replaced
+(psutil.net_connections(), then dropping connected sockets) on a synthetic
+/proc with many established connections and a few listeners.
+
+    python -m benchmarks.pslisten_procfs [--connections N] [--processes N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import psutil
+
+from psutilz.pslisten import (
+    SocketOwnerIndex,
+    iter_proc_net_listeners,
+    listeners_to_connections,
+)
+
+TCP_HEADER = (
+    "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+    "retrnsmt   uid  timeout inode\n"
+)
+ROW = (
+    "%6d: %s %s %s 00000000:00000000 00:00000000 00000000  1000        0 "
+    "%d 1 0000000000000000 100 0 0 10 0\n"
+)
+LISTENERS = 10
+
+
+def make_procfs(root, connections, processes):
+    """
+    Writes a /proc under `root` with `connections` established tcp
+    connections and LISTENERS listening sockets, spread over `processes`
+    processes' fds.
+    """
+    os.makedirs(os.path.join(root, "net"))
+    with open(os.path.join(root, "net", "tcp"), "w") as f:
+        f.write(TCP_HEADER)
+        for i in range(LISTENERS):
+            f.write(
+                ROW % (i, "0100007F:%04X" % (8000 + i), "00000000:0000", "0A", i + 1)
+            )
+        for i in range(connections):
+            local = "0100007F:%04X" % (8000 + i % LISTENERS)
+            remote = "0A000001:%04X" % (1024 + i % 60000)
+            f.write(ROW % (LISTENERS + i, local, remote, "01", LISTENERS + i + 1))
+    for name in ["tcp6", "udp", "udp6"]:
+        with open(os.path.join(root, "net", name), "w") as f:
+            f.write(TCP_HEADER)
+
+    inodes = range(1, LISTENERS + connections + 1)
+    for pid in range(1, processes + 1):
+        proc_dir = os.path.join(root, str(pid))
+        os.makedirs(os.path.join(proc_dir, "fd"))
+        fields = ["S", 0 if pid == 1 else 1] + [0] * 17 + [pid]
+        with open(os.path.join(proc_dir, "stat"), "w") as f:
+            f.write("%d (proc%d) %s\n" % (pid, pid, " ".join(map(str, fields))))
+        for fd, inode in enumerate(inodes[pid - 1 :: processes], 3):
+            os.symlink("socket:[%d]" % inode, os.path.join(proc_dir, "fd", str(fd)))
+
+
+def psutil_path():
+    return [conn for conn in psutil.net_connections("tcp") if not conn.raddr]
+
+
+def fast_path(procfs):
+    listeners = iter_proc_net_listeners(procfs)
+    return listeners_to_connections(listeners, SocketOwnerIndex(procfs))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    arg_parser.add_argument("--connections", type=int, default=100000)
+    arg_parser.add_argument("--processes", type=int, default=100)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        make_procfs(root, args.connections, args.processes)
+        psutil.PROCFS_PATH = root
+        psutil_time, psutil_conns = timed(psutil_path)
+        fast_time, fast_conns = timed(fast_path, root)
+
+    assert sorted(c.laddr for c in psutil_conns) == sorted(c.laddr for c in fast_conns)
+    print(
+        "%d connections, %d listeners, %d processes"
+        % (args.connections, len(fast_conns), args.processes)
+    )
+    print("psutil:  %.3fs" % psutil_time)
+    print("procfs:  %.3fs" % fast_time)
+
+
+if __name__ == "__main__":
+    main()
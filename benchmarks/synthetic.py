@@ -0,0 +1,48 @@
+"""
+Synthetic process tables for the ps.py benchmarks.
+"""
+
+import random
+from collections import namedtuple
+
+from psutilz.ps import ProcInfo
+
+puids = namedtuple("puids", ["real", "effective", "saved"])
+pmem = namedtuple("pmem", ["rss", "vms"])
+
+
+def process_table(n, deep_fraction=0.1, seed=0):
+    """
+    Returns `n` `ProcInfo`s, with every attribute ps.py can show, forming a
+    random bushy tree under pid 1 plus a single fork chain `deep_fraction`
+    of them long, to catch anything recursive.
+    """
+    rng = random.Random(seed)
+    chain = int(n * deep_fraction)
+    procs = []
+    for pid in range(1, n + 1):
+        if pid == 1:
+            ppid = 0
+        elif pid <= chain + 1:
+            ppid = pid - 1  # the fork chain
+        else:
+            ppid = rng.randint(1, pid - 1)
+        uid = rng.choice([0, 1000, 1001, 65534])
+        info = {
+            "pid": pid,
+            "ppid": ppid,
+            "name": "proc%d" % (pid % 50),
+            "cmdline": ["/usr/bin/proc%d" % (pid % 50), "--id", str(pid), "a b"],
+            "uids": puids(uid, uid, uid),
+            "username": "user%d" % uid,
+            "nice": 0,
+            "cpu_percent": rng.random() * 10,
+            "memory_percent": rng.random(),
+            "memory_info": pmem(rng.randint(1, 1 << 30), 1 << 31),
+            "num_threads": rng.randint(1, 64),
+            "num_fds": rng.randint(3, 1024),
+            "create_time": 1.7e9 + pid // 10,
+        }
+        procs.append(ProcInfo(pid, info))
+    rng.shuffle(procs)  # psutil.process_iter() isn't sorted either
+    return procs
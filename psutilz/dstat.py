@@ -8,7 +8,14 @@ import datetime
 import psutil
 import shutil
 import signal
-import abc
+import array
+import bisect
+import csv
+import io
+import json
+import itertools
+import operator
+from typing import NamedTuple
 
 ANSI_ESCAPES = {
     "black": "\033[0;30m",
@@ -38,39 +45,164 @@ HEAT_COLORS = [
     ANSI_ESCAPES["red"],  # (1)
 ]
 
-# base class for a single statistic
-class Statistic(abc.ABC):
-    def __init__(self, value, unit, width):
-        self.value = value
-        self.unit = unit
-        self.width = width
-        self.value_width = width - len(unit)
 
-    @abc.abstractmethod
-    def heat_level(self):
+HEAT_PREFIXES = [color + BOLD for color in HEAT_COLORS]
+UNITS = [" ", "k", "m", "g", "t", "p"]
+UNIT_SUFFIXES = {unit: RESET + DARKGREY + BOLD + unit + RESET for unit in ["", *UNITS]}
+
+
+class Cell(NamedTuple):
+    """
+    How to render one value of a collector. Numbers are right-aligned to
+    `width` characters, including a one-character unit suffix if they are
+    scaled down by multiples of `scale` (1024 for bytes, 1000 for counts),
+    and colored by their heat level (0 blue to 4 red): the
+    number of ascending `thresholds` they are not below. `zero`, if given,
+    replaces the whole rendering of 0. If `text`, the value is a string,
+    left-aligned to `width` in grey.
+    """
+
+    width: int
+    thresholds: tuple = ()
+    scale: int = 0
+    zero: str = None
+    text: bool = False
+
+
+class RowRenderer:
+    """
+    Renders rows of values for the given `cells` (one tuple of cells per
+    collector) into a single reusable buffer, with everything that doesn't
+    depend on the values worked out up front. Without ansi colors if not
+    `color`.
+    """
+
+    COLUMN_DELIM = BLUE + "|" + RESET
+
+    def __init__(self, cells, color=True):
+        if color:
+            self.heat_prefixes = HEAT_PREFIXES
+            self.unit_suffixes = UNIT_SUFFIXES
+            self.grey, self.reset = DARKGREY, RESET
+            column_delim = self.COLUMN_DELIM
+        else:
+            self.heat_prefixes = [""] * len(HEAT_PREFIXES)
+            self.unit_suffixes = {unit: unit for unit in UNIT_SUFFIXES}
+            self.grey = self.reset = ""
+            column_delim = "|"
+        self.specs = []
+        for i, collector_cells in enumerate(cells):
+            for j, cell in enumerate(collector_cells):
+                if j > 0:
+                    separator = " "
+                elif i > 0:
+                    separator = column_delim
+                else:
+                    separator = ""
+                value_width = cell.width - (1 if cell.scale else 0)
+                if cell.zero is not None:
+                    zero = self.heat_prefixes[0] + cell.zero + self.reset
+                else:
+                    zero = (
+                        self.heat_prefixes[0]
+                        + " " * (value_width - 1)
+                        + "0"
+                        + self.unit_suffixes[" " if cell.scale else ""]
+                    )
+                self.specs.append(
+                    (
+                        separator,
+                        cell.text,
+                        cell.thresholds,
+                        cell.scale,
+                        value_width,
+                        zero,
+                    )
+                )
+        self.buffer = []
+
+    def render(self, values):
         """
-        Returns a value between 0 (blue) and 4 (red)
+        Returns the row for `values`, an iterable per collector of its
+        values, in the same order as the cells.
         """
-        raise NotImplementedError
+        out = self.buffer
+        out.clear()
+        heat_prefixes, unit_suffixes = self.heat_prefixes, self.unit_suffixes
+        for spec, value in zip(self.specs, itertools.chain.from_iterable(values)):
+            separator, text, thresholds, scale, value_width, zero = spec
+            out.append(separator)
+            if text:
+                out.append(self.grey + value[:value_width].ljust(value_width))
+                out.append(self.reset)
+                continue
+            if value == 0:  # int or float
+                out.append(zero)
+                continue
+            out.append(heat_prefixes[bisect.bisect_right(thresholds, value)])
+            unit = ""
+            if scale:
+                i = 0
+                while value >= scale and i < 5:
+                    value /= scale
+                    i += 1
+                unit = UNITS[i]
+            if isinstance(value, int):
+                out.append("% *d" % (value_width, value))
+            else:
+                out.append(("%.6f" % value)[:value_width])
+            out.append(unit_suffixes[unit])
+        return "".join(out)
+
+
+OUTPUT_FORMATS = ["csv", "jsonl"]
+
+
+class RecordWriter:
+    """
+    Writes rows of raw values, named `fields`, to the file at `path` in
+    `format` (csv or jsonl). Rows are kept in memory and only written out
+    every `flush_rows` rows or `flush_interval` seconds, whichever comes
+    first, and on `close()`, so that long captures at short intervals cost
+    next to nothing.
+    """
 
-    def to_str(self):
-        if self.value == 0:  # int or float
-            value_str = " " * (self.value_width - 1) + "0"
-        elif isinstance(self.value, int):
-            value_str = "% *d" % (self.value_width, self.value)
+    def __init__(self, path, format, fields, flush_rows=100, flush_interval=10.0):
+        self.file = open(path, "w", newline="")
+        self.format = format
+        self.fields = fields
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.buffer)
+        if format == "csv":
+            self.csv_writer.writerow(fields)
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, values, t):
+        """
+        Adds a row of `values`, sampled at monotonic time `t`.
+        """
+        if self.format == "csv":
+            self.csv_writer.writerow(values)
         else:
-            value_str = ("%.6f" % self.value)[: self.value_width]
-        result = (
-            HEAT_COLORS[self.heat_level()]
-            + BOLD
-            + value_str
-            + RESET
-            + DARKGREY
-            + BOLD
-            + self.unit
-            + RESET
-        )
-        return result
+            self.buffer.write(json.dumps(dict(zip(self.fields, values))) + "\n")
+        self.rows += 1
+        if self.rows >= self.flush_rows or t - self.last_flush >= self.flush_interval:
+            self.flush(t)
+
+    def flush(self, t=None):
+        self.file.write(self.buffer.getvalue())
+        self.file.flush()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.rows = 0
+        self.last_flush = time.monotonic() if t is None else t
+
+    def close(self):
+        self.flush()
+        self.file.close()
 
 
 # === mac ===
@@ -86,76 +218,388 @@ class Statistic(abc.ABC):
 # scpustats(ctx_switches=10839719127, interrupts=8227216711, soft_interrupts=14619700996, syscalls=0)
 
 
-class Time:
-    def header0(self):
-        return "--------system---------"
+def _psutil_source(func, *fields):
+    """
+    Returns a function that calls `func` and returns a plain tuple of the
+    `fields` of its result (zeros if it returns None, e.g. no disks).
+    """
+    getter = operator.attrgetter(*fields)
+
+    def read():
+        result = func()
+        return getter(result) if result is not None else (0,) * len(fields)
+
+    return read
 
-    def header1(self):
-        return ("         time          ",)
 
-    def value(self):
+def _psutil_per_device_source(func, *fields):
+    """
+    Returns a function that calls `func` with per-device results and returns
+    them as (names, counters), with the `fields` of each device in the flat
+    array `counters`.
+    """
+    getter = operator.attrgetter(*fields)
+
+    def read():
+        results = func(True) or {}
+        counters = array.array("d")
+        for result in results.values():
+            counters.extend(getter(result))
+        return tuple(results), counters
+
+    return read
+
+
+# Sources that collectors can depend on, by name, read with psutil. Each
+# returns a plain tuple, laid out as commented.
+SOURCES = {
+    # (1m, 5m, 15m)
+    "loadavg": psutil.getloadavg,
+    # in the order of psutil.cpu_times()._fields
+    "cpu_times": lambda: tuple(psutil.cpu_times()),
+    "disk_io": _psutil_source(psutil.disk_io_counters, "read_bytes", "write_bytes"),
+    "net_io": _psutil_source(psutil.net_io_counters, "bytes_recv", "bytes_sent"),
+    "virtual_memory": _psutil_source(psutil.virtual_memory, "used", "available"),
+    "swap_memory": _psutil_source(psutil.swap_memory, "sin", "sout"),
+    "cpu_stats": _psutil_source(
+        psutil.cpu_stats, "ctx_switches", "interrupts", "soft_interrupts", "syscalls"
+    ),
+    # Per-device sources are (names, counters), with `counters` a flat array
+    # of the same number of counters for each device, in the order of
+    # `names`, so that deltas can be taken in one pass (see
+    # `Snapshot.deltas()`) without an object per device.
+    # cpu numbers, and cpu_times for each
+    "percpu_times": lambda: (
+        tuple(str(i) for i in range(psutil.cpu_count())),
+        array.array("d", itertools.chain.from_iterable(psutil.cpu_times(True))),
+    ),
+    # disk names, and (read_bytes, write_bytes) for each
+    "perdisk_io": _psutil_per_device_source(
+        psutil.disk_io_counters, "read_bytes", "write_bytes"
+    ),
+    # nic names, and (bytes_recv, bytes_sent) for each
+    "pernic_io": _psutil_per_device_source(
+        psutil.net_io_counters, "bytes_recv", "bytes_sent"
+    ),
+    # {pid: (name, user + system cpu time)}
+    "process_cpu_times": lambda: {
+        proc.pid: (proc.info["name"], sum(proc.info["cpu_times"][:2]))
+        for proc in psutil.process_iter(["name", "cpu_times"])
+        if proc.info["cpu_times"] is not None
+    },
+}
+
+
+class ProcfsSources:
+    """
+    Linux versions of SOURCES, with the same results as psutil's, that read
+    /proc directly. Each file is opened once and re-read with pread() into a
+    buffer that is reused from tick to tick, at most once per tick even if
+    several sources use it (/proc/stat), and only the fields needed are
+    parsed out of it.
+    """
+
+    FILES = {
+        "cpu_times": "stat",
+        "percpu_times": "stat",
+        "cpu_stats": "stat",
+        "disk_io": "diskstats",
+        "perdisk_io": "diskstats",
+        "net_io": "net/dev",
+        "pernic_io": "net/dev",
+        "virtual_memory": "meminfo",
+        "swap_memory": "vmstat",
+    }
+    SECTOR_SIZE = 512  # /proc/diskstats counts 512-byte sectors
+    PAGE_SIZE = 4096  # /proc/vmstat pswpin/pswpout, as psutil assumes
+
+    def __init__(self, procfs="/proc", sysfs="/sys"):
+        self.procfs = procfs
+        self.fds = {}
+        self.buffers = {}
+        self.lengths = {}  # file -> length read this tick
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        # whole disks only (not partitions), like psutil
+        self.disks = {
+            name.replace("!", "/").encode()
+            for name in os.listdir(os.path.join(sysfs, "block"))
+        }
+
+    @classmethod
+    def available(cls, procfs="/proc", sysfs="/sys"):
         return (
-            DARKGREY
-            + datetime.datetime.now().isoformat(timespec="milliseconds")
-            + RESET
+            psutil.LINUX
+            and all(os.path.exists(os.path.join(procfs, f)) for f in cls.FILES.values())
+            and os.path.isdir(os.path.join(sysfs, "block"))
         )
 
+    def start_tick(self):
+        self.lengths.clear()
 
-class LoadAvg(Statistic):
-    def __init__(self, value):
-        super().__init__(value, unit="", width=4)
+    def _read(self, name):
+        """
+        Returns (buffer, length) with the contents of /proc/`name` as of
+        this tick.
+        """
+        if name not in self.lengths:
+            if name not in self.fds:
+                self.fds[name] = os.open(os.path.join(self.procfs, name), os.O_RDONLY)
+                self.buffers[name] = bytearray(8192)
+            fd, buf = self.fds[name], self.buffers[name]
+            # files like net/dev and diskstats return at most about a page
+            # of whole lines per read, so read on until end of file
+            length = 0
+            while True:
+                if length == len(buf):
+                    buf.extend(bytes(len(buf)))
+                n = os.preadv(fd, [memoryview(buf)[length:]], length)
+                if n == 0:
+                    break
+                length += n
+            self.lengths[name] = length
+        return self.buffers[name], self.lengths[name]
 
-    def heat_level(self):
-        # :shrug:
-        if self.value < 0.5:
+    @staticmethod
+    def _field(buf, length, key):
+        """
+        Returns the first number after `key` (e.g. b"\nctxt ") in `buf`.
+        """
+        start = buf.find(key, 0, length)
+        if start < 0:
             return 0
-        elif self.value < 1:
-            return 1
-        elif self.value < 2:
-            return 2
-        elif self.value < 5:
-            return 3
-        else:
-            return 4
+        start += len(key)
+        end = buf.find(b"\n", start, length)
+        return int(buf[start:end].split(None, 1)[0])
+
+    def cpu_times(self):
+        buf, length = self._read("stat")
+        end = buf.find(b"\n", 0, length)
+        return tuple(int(t) / self.clock_ticks for t in buf[4:end].split())
+
+    def percpu_times(self):
+        buf, length = self._read("stat")
+        # the "cpuN ..." lines after the total "cpu ..." line, split as a
+        # whole into names and counters
+        n = len(buf[4 : buf.find(b"\n", 0, length)].split()) + 1  # name + times
+        start = buf.find(b"\ncpu", 0, length) + 1
+        if start == 0:
+            return (), array.array("d")
+        end = buf.find(b"\n", buf.rfind(b"\ncpu", 0, length) + 1, length)
+        tokens = bytes(memoryview(buf)[start:end]).split()
+        names = tuple(name[3:].decode() for name in tokens[::n])
+        del tokens[::n]
+        counters = array.array(
+            "d",
+            map(
+                operator.truediv, map(float, tokens), itertools.repeat(self.clock_ticks)
+            ),
+        )
+        return names, counters
+
+    def cpu_stats(self):
+        buf, length = self._read("stat")
+        return (
+            self._field(buf, length, b"\nctxt "),
+            self._field(buf, length, b"\nintr "),
+            self._field(buf, length, b"\nsoftirq "),
+            0,  # not available on linux
+        )
+
+    def disk_io(self):
+        buf, length = self._read("diskstats")
+        read_sectors = write_sectors = 0
+        for line in bytes(memoryview(buf)[:length]).splitlines():
+            fields = line.split()
+            if fields[2] in self.disks:
+                read_sectors += int(fields[5])
+                write_sectors += int(fields[9])
+        return read_sectors * self.SECTOR_SIZE, write_sectors * self.SECTOR_SIZE
+
+    def perdisk_io(self):
+        buf, length = self._read("diskstats")
+        names = []
+        counters = array.array("d")
+        for line in bytes(memoryview(buf)[:length]).splitlines():
+            fields = line.split()
+            names.append(fields[2].decode())
+            counters.append(int(fields[5]) * self.SECTOR_SIZE)
+            counters.append(int(fields[9]) * self.SECTOR_SIZE)
+        return tuple(names), counters
+
+    def net_io(self):
+        buf, length = self._read("net/dev")
+        bytes_recv = bytes_sent = 0
+        for line in bytes(memoryview(buf)[:length]).splitlines()[2:]:
+            fields = line[line.index(b":") + 1 :].split()
+            bytes_recv += int(fields[0])
+            bytes_sent += int(fields[8])
+        return bytes_recv, bytes_sent
+
+    def pernic_io(self):
+        buf, length = self._read("net/dev")
+        names = []
+        counters = array.array("d")
+        for line in bytes(memoryview(buf)[:length]).splitlines()[2:]:
+            colon = line.index(b":")
+            fields = line[colon + 1 :].split()
+            names.append(line[:colon].strip().decode())
+            counters.append(int(fields[0]))
+            counters.append(int(fields[8]))
+        return tuple(names), counters
+
+    def virtual_memory(self):
+        buf, length = self._read("meminfo")
+        total = self._field(buf, length, b"MemTotal:")
+        available = self._field(buf, length, b"\nMemAvailable:")
+        return (total - available) * 1024, available * 1024
+
+    def swap_memory(self):
+        buf, length = self._read("vmstat")
+        return (
+            self._field(buf, length, b"\npswpin ") * self.PAGE_SIZE,
+            self._field(buf, length, b"\npswpout ") * self.PAGE_SIZE,
+        )
+
+
+BACKENDS = ["psutil", "procfs"]
+
+
+class Snapshot:
+    """
+    Everything sampled in one tick: `time` from a single read of the
+    monotonic clock (for computing rates), `now` the wall clock time (for
+    display), and `values[source]` for each source read.
+    """
+
+    def __init__(self, time, now, values):
+        self.time = time
+        self.now = now
+        self.values = values
+        self._deltas = {}
+
+    def __getitem__(self, source):
+        return self.values[source]
+
+    def deltas(self, last, source):
+        """
+        For a per-device `source`, returns (offsets, deltas): the change in
+        every device's counters since `last`, taken in one pass over the
+        flat arrays, and the offset of each device's counters in `deltas`.
+        Worked out once per snapshot, however many collectors ask for it.
+        """
+        if source not in self._deltas:
+            names, counters = self.values[source]
+            last_names, last_counters = last.values[source]
+            n = len(counters) // len(names) if names else 0
+            offsets = dict(zip(names, range(0, len(counters), n or 1)))
+            if names != last_names:
+                # devices came or went; line up the ones in both, and take
+                # new ones as unchanged
+                last_offsets = dict(
+                    zip(last_names, range(0, len(last_counters), n or 1))
+                )
+                aligned = array.array("d")
+                for name, offset in offsets.items():
+                    if name in last_offsets:
+                        last_offset = last_offsets[name]
+                        aligned.extend(last_counters[last_offset : last_offset + n])
+                    else:
+                        aligned.extend(counters[offset : offset + n])
+                last_counters = aligned
+            deltas = array.array("d", map(operator.sub, counters, last_counters))
+            self._deltas[source] = offsets, deltas
+        return self._deltas[source]
+
+
+class Sampler:
+    """
+    Reads each of `sources` exactly once per call to `sample()`, so that
+    every collector sees the same data, with rates computed over the same
+    window. A source is a name from SOURCES, or a function of no arguments
+    (e.g. one provided by a plugin collector), whose result is stored in the
+    snapshot under the function itself.
+
+    `backend` is "procfs" to read /proc directly (linux only), "psutil", or
+    None for procfs where available and psutil elsewhere.
+    """
+
+    def __init__(self, sources, backend=None):
+        self.procfs = None
+        if backend != "psutil" and ProcfsSources.available():
+            self.procfs = ProcfsSources()
+        self.readers = []
+        for source in dict.fromkeys(sources):
+            if callable(source):
+                self.readers.append((source, source))
+            elif source in SOURCES:
+                read = getattr(self.procfs, source, None) or SOURCES[source]
+                self.readers.append((source, read))
+            else:
+                raise ValueError("unknown source %r" % source)
+
+    def sample(self):
+        if self.procfs:
+            self.procfs.start_tick()
+        t = time.monotonic()
+        now = datetime.datetime.now()
+        return Snapshot(t, now, {source: read() for source, read in self.readers})
+
+
+# Collectors declare the SOURCES they need in `sources`, or functions that
+# read data of their own (see Sampler), and how to render their values in
+# `cells`, return their column headers from `header0()` (the title) and
+# `header1()` (one per cell), and compute their values from a snapshot,
+# along with the previous one for rates, in `value()`.
+
+
+class Time:
+    sources = ()
+    cells = (Cell(23, text=True),)
+
+    def header0(self):
+        return "--------system---------"
+
+    def header1(self):
+        return ("         time          ",)
+
+    def value(self, snapshot, last):
+        return (snapshot.now.isoformat(timespec="milliseconds"),)
 
 
 class LoadAvgs:
+    sources = ("loadavg",)
+    cells = (Cell(4, (0.5, 1, 2, 5)),) * 3  # :shrug:
+
     def header0(self):
         return "---load-avg---"
 
     def header1(self):
         return " 1m ", " 5m ", " 15m"
 
-    def value(self):
-        loads = (LoadAvg(load).to_str() for load in psutil.getloadavg())
-        return " ".join(loads)
+    def value(self, snapshot, last):
+        return snapshot["loadavg"]
 
 
-class CpuTime(Statistic):
-    def __init__(self, name, value):
-        self.name = name
-        super().__init__(value, unit="", width=3)
+def cpu_times_percent(deltas, counted_twice=()):
+    """
+    Like `psutil.cpu_times_percent()`, but from the given changes in
+    cpu_times. `counted_twice` are the indexes of times that are also
+    included in other times, so don't count towards the total.
+    """
+    elapsed = sum(deltas) - sum(deltas[i] for i in counted_twice)
+    if elapsed <= 0:
+        return [0.0] * len(deltas)
+    return [min(max(0.0, delta / elapsed * 100), 100.0) for delta in deltas]
 
-    def heat_level(self):
-        # if self.name == 'idle':
-        #     return 0
-        # elif self.value < 5:
-        if self.value < 5:
-            return 0
-        elif self.value < 15:
-            return 1
-        elif self.value < 35:
-            return 2
-        elif self.value < 70:
-            return 3
-        else:
-            return 4
 
-    def to_str(self):
-        if self.value == 0:
-            return HEAT_COLORS[0] + BOLD + "0.0" + RESET
-        else:
-            return super().to_str()
+def title(text, width):
+    """
+    Returns `text` centered in a header of dashes `width` wide.
+    """
+    return text[:width].center(width, "-")
+
+
+TOTAL = "total"
 
 
 class CpuTimes:
@@ -179,13 +623,26 @@ class CpuTimes:
         "guest_nice": "gni",
     }
 
-    def __init__(self):
-        cputimes = psutil.cpu_times_percent()
-        self._header1 = [self.ABBRS.get(f) or f[:3] for f in cputimes._fields]
-        space_to_fill = 4 * len(self._header1) - 1 - len("total-cpu-usage")
-        self._header0 = (
-            "-" * (space_to_fill // 2) + "total-cpu-usage" + "-" * (space_to_fill // 2)
+    def __init__(self, cpu=TOTAL):
+        """
+        Shows usage of all cpus if `cpu` is "total", otherwise of that one
+        (a number, as a string).
+        """
+        self.cpu = cpu
+        self.sources = ("cpu_times",) if cpu == TOTAL else ("percpu_times",)
+        self._fields = psutil.cpu_times()._fields
+        # on linux guest time is already counted in user time
+        self._counted_twice = [
+            i
+            for i, f in enumerate(self._fields)
+            if psutil.LINUX and f in ("guest", "guest_nice")
+        ]
+        self._header1 = [self.ABBRS.get(f) or f[:3] for f in self._fields]
+        self._header0 = title(
+            "total-cpu-usage" if cpu == TOTAL else "cpu%s-usage" % cpu,
+            4 * len(self._header1) - 1,
         )
+        self.cells = (Cell(3, (5, 15, 35, 70), zero="0.0"),) * len(self._fields)
 
     def header0(self):
         return self._header0
@@ -193,288 +650,320 @@ class CpuTimes:
     def header1(self):
         return self._header1
 
-    def value(self):
-        cputimes = psutil.cpu_times_percent()
-        formatted_cputimes = (
-            CpuTime(name, value).to_str() for name, value in cputimes._asdict().items()
-        )
-        result = " ".join(formatted_cputimes)
-        return result
+    def value(self, snapshot, last):
+        if self.cpu == TOTAL:
+            deltas = list(map(operator.sub, snapshot["cpu_times"], last["cpu_times"]))
+        else:
+            offsets, all_deltas = snapshot.deltas(last, "percpu_times")
+            offset = offsets.get(self.cpu)
+            if offset is None:  # offline
+                return (0.0,) * len(self._fields)
+            deltas = all_deltas[offset : offset + len(self._fields)]
+        return cpu_times_percent(deltas, self._counted_twice)
 
 
-def pretty_bytes(value, b=" "):
+class DeviceRates:
     """
-    Returns tuple (value, unit)
+    Base class for the rates of a pair of byte counters, `source` for the
+    total or `per_device_source` for `device` (a name) unless it's "total".
     """
-    number = value
-    for unit in [b, "k", "m", "g", "t", "p"]:
-        if number < 1024.0 or unit == "p":
-            break
-        number /= 1024.0
-    return number, unit
-
-
-class DiskStat(Statistic):
-    def __init__(self, value):
-        self.raw_value = value
-        number, unit = pretty_bytes(value)
-        super().__init__(number, unit=unit, width=5)
-
-    def heat_level(self):
-        if self.raw_value < 10 * 1024:
-            return 0
-        elif self.raw_value < 200 * 1024:
-            return 1
-        elif self.raw_value < 1024 * 1024:
-            return 2
-        elif self.raw_value < 10 * 1024 * 1024:
-            return 3
-        else:
-            return 4
-
 
-class DiskStats:
-    def __init__(self):
-        self.last_time = time.time()
-        self.last_values = psutil.disk_io_counters()
+    def __init__(self, device=TOTAL):
+        self.device = device
+        self.sources = (self.source,) if device == TOTAL else (self.per_device_source,)
+        self._header0 = title("%s/%s" % (self.prefix, device), 11)
 
     def header0(self):
-        return "-dsk/total-"
+        return self._header0
+
+    def value(self, snapshot, last):
+        elapsed = snapshot.time - last.time
+        if self.device == TOTAL:
+            first, second = snapshot[self.source]
+            last_first, last_second = last[self.source]
+            return (first - last_first) / elapsed, (second - last_second) / elapsed
+        offsets, deltas = snapshot.deltas(last, self.per_device_source)
+        offset = offsets.get(self.device)
+        if offset is None:  # no such device (yet)
+            return 0, 0
+        return deltas[offset] / elapsed, deltas[offset + 1] / elapsed
+
+
+class DiskStats(DeviceRates):
+    source = "disk_io"
+    per_device_source = "perdisk_io"
+    prefix = "dsk"
+    cells = (Cell(5, (10 * 1024, 200 * 1024, 1024 * 1024, 10 * 1024 * 1024), 1024),) * 2
 
     def header1(self):
         return " read", " writ"
 
-    def value(self):
-        t = time.time()
-        values = psutil.disk_io_counters()
 
-        elapsed = t - self.last_time
-        read_bytes = values.read_bytes - self.last_values.read_bytes
-        write_bytes = values.write_bytes - self.last_values.write_bytes
+class NetStats(DeviceRates):
+    source = "net_io"
+    per_device_source = "pernic_io"
+    prefix = "net"
+    cells = (Cell(5, (10 * 1024, 100 * 1024, 768 * 1024, 2 * 1024 * 1024), 1024),) * 2
 
-        result = (
-            DiskStat(read_bytes / elapsed).to_str()
-            + " "
-            + DiskStat(write_bytes / elapsed).to_str()
-        )
-
-        self.last_time = t
-        self.last_values = values
-
-        return result
-
-
-class NetStat(Statistic):
-    def __init__(self, value):
-        self.raw_value = value
-        number, unit = pretty_bytes(value)
-        super().__init__(number, unit=unit, width=5)
+    def header1(self):
+        return " recv", " send"
 
-    def heat_level(self):
-        if self.raw_value < 10 * 1024:
-            return 0
-        elif self.raw_value < 100 * 1024:
-            return 1
-        elif self.raw_value < 768 * 1024:
-            return 2
-        elif self.raw_value < 2 * 1024 * 1024:
-            return 3
-        else:
-            return 4
 
+class MemUsages:
+    # TODO add support for buff/cached (not available on mac)
 
-class NetStats:
-    def __init__(self):
-        self.last_time = time.time()
-        self.last_values = psutil.net_io_counters()
+    sources = ("virtual_memory",)
+    cells = (Cell(5, scale=1024),) * 2
 
     def header0(self):
-        return "-net/total-"
+        return "-mem-usage-"
 
     def header1(self):
-        return " recv", " send"
-
-    def value(self):
-        t = time.time()
-        values = psutil.net_io_counters()
+        return " used", " free"
 
-        elapsed = t - self.last_time
-        bytes_recv = values.bytes_recv - self.last_values.bytes_recv
-        bytes_sent = values.bytes_sent - self.last_values.bytes_sent
+    def value(self, snapshot, last):
+        return snapshot["virtual_memory"]
 
-        result = (
-            NetStat(bytes_recv / elapsed).to_str()
-            + " "
-            + NetStat(bytes_sent / elapsed).to_str()
-        )
 
-        self.last_time = t
-        self.last_values = values
+class Paging:
+    sources = ("swap_memory",)
+    cells = (Cell(5, (1024, 10 * 1024, 100 * 1024, 1024 * 1024), 1024),) * 2
 
-        return result
+    def header0(self):
+        return "---paging--"
 
+    def header1(self):
+        return "  in ", "  out "
 
-class MemUsage(Statistic):
-    def __init__(self, value):
-        number, unit = pretty_bytes(value)
-        super().__init__(number, unit=unit, width=5)
+    def value(self, snapshot, last):
+        sin, sout = snapshot["swap_memory"]
+        last_sin, last_sout = last["swap_memory"]
 
-    def heat_level(self):
-        return 0
+        elapsed = snapshot.time - last.time
+        return int((sin - last_sin) / elapsed), int((sout - last_sout) / elapsed)
 
 
-class MemUsages:
-    # TODO add support for buff/cached (not available on mac)
+class TopCpu:
+    sources = ("process_cpu_times",)
+    cells = (Cell(12, text=True), Cell(3, (5, 15, 35, 70)))
 
     def header0(self):
-        return "-mem-usage-"
+        return "-most-expensive-"
 
     def header1(self):
-        return " used", " free"
+        return "cpu process ", "  %"
 
-    def value(self):
-        vm = psutil.virtual_memory()
-        return MemUsage(vm.used).to_str() + " " + MemUsage(vm.available).to_str()
+    def value(self, snapshot, last):
+        times, last_times = snapshot["process_cpu_times"], last["process_cpu_times"]
+        top_name, top_time = "", 0
+        for pid, (name, cpu_time) in times.items():
+            if pid in last_times:
+                cpu_time -= last_times[pid][1]
+            if cpu_time > top_time:
+                top_name, top_time = name, cpu_time
+        percent = top_time / (snapshot.time - last.time) * 100
+        return top_name, percent
 
 
-class PagingStat(Statistic):
-    def __init__(self, value):
-        self.raw_value = value
-        # super().__init__(value, '', width=5)
-        number, unit = pretty_bytes(value)
-        super().__init__(number, unit=unit, width=5)
-
-    def heat_level(self):
-        if self.raw_value < 1024:
-            return 0
-        elif self.raw_value < 10 * 1024:
-            return 1
-        elif self.raw_value < 100 * 1024:
-            return 2
-        elif self.raw_value < 1024 * 1024:
-            return 3
-        else:
-            return 4
+class System:
+    sources = ("cpu_stats",)
 
+    # header, and whether it's available, for each of the cpu_stats
+    FIELDS = [
+        (" csw ", True),
+        (" int ", True),
+        (" sirq", not (psutil.WINDOWS or psutil.SUNOS)),
+        (" scal", not psutil.LINUX),
+    ]
 
-class Paging:
     def __init__(self):
-        self.last_time = time.time()
-        self.last_values = psutil.swap_memory()
+        # interrupts first, like the original dstat
+        self._indexes = [i for i in (1, 0, 2, 3) if self.FIELDS[i][1]]
+        self._header1 = [self.FIELDS[i][0] for i in self._indexes]
+        self._header0 = title("system", 6 * len(self._indexes) - 1)
+        self.cells = (Cell(5, (1000, 10 * 1000, 100 * 1000, 1000 * 1000), 1000),) * len(
+            self._indexes
+        )
 
     def header0(self):
-        return "---paging--"
+        return self._header0
 
     def header1(self):
-        return "  in ", "  out "
-
-    def value(self):
-        t = time.time()
-        values = psutil.swap_memory()
-
-        elapsed = t - self.last_time
-        sin = values.sin - self.last_values.sin
-        sout = values.sout - self.last_values.sout
-
-        result = (
-            PagingStat(int(sin / elapsed)).to_str()
-            + " "
-            + PagingStat(int(sout / elapsed)).to_str()
-        )
+        return self._header1
 
-        self.last_values = values
-        self.last_time = t
+    def value(self, snapshot, last):
+        values, last_values = snapshot["cpu_stats"], last["cpu_stats"]
 
-        return result
+        elapsed = snapshot.time - last.time
+        # max() because counters can wrap, or go backwards on mac (see
+        # https://github.com/giampaolo/psutil/issues/847)
+        return [
+            int(max(0, values[i] - last_values[i]) / elapsed) for i in self._indexes
+        ]
 
 
-class System:
-    def __init__(self):
-        self.last_time = time.time()
-        self.last_values = psutil.cpu_stats()
+class CollectorSpec(NamedTuple):
+    flags: tuple  # command line flags that select it
+    help: str
+    create: callable  # parsed command line options -> list of collectors
+
+
+COLLECTORS = {
+    "time": CollectorSpec(("-t", "--time"), "wall clock time", lambda _: [Time()]),
+    "load": CollectorSpec(("-l", "--load"), "load averages", lambda _: [LoadAvgs()]),
+    "cpu": CollectorSpec(
+        ("-c", "--cpu"),
+        "cpu usage (see -C)",
+        lambda options: [CpuTimes(cpu) for cpu in options.cpus],
+    ),
+    "disk": CollectorSpec(
+        ("-d", "--disk"),
+        "disk throughput (see -D)",
+        lambda options: [DiskStats(disk) for disk in options.disks],
+    ),
+    "net": CollectorSpec(
+        ("-n", "--net"),
+        "network throughput (see -N)",
+        lambda options: [NetStats(nic) for nic in options.nics],
+    ),
+    "mem": CollectorSpec(("-m", "--mem"), "memory usage", lambda _: [MemUsages()]),
+    "page": CollectorSpec(("-g", "--page"), "paging", lambda _: [Paging()]),
+    "sys": CollectorSpec(
+        ("-y", "--sys"),
+        "interrupts, context switches, softirqs and syscalls (where available)",
+        lambda _: [System()],
+    ),
+    "top-cpu": CollectorSpec(
+        ("--top-cpu",), "the process using the most cpu", lambda _: [TopCpu()]
+    ),
+}
+DEFAULT_COLLECTORS = ["time", "load", "cpu", "disk", "net", "mem", "page", "sys"]
 
-    def header0(self):
-        return "---system--"
+# Third-party packages can add collectors with entry points in this group,
+# named for the flag that selects them (--NAME) and referring to a collector
+# class, which is only imported if selected.
+PLUGIN_GROUP = "psutilz.dstat.collectors"
 
-    def header1(self):
-        return " int ", " csw "
-
-    def value(self):
-        t = time.time()
-        values = psutil.cpu_stats()
-
-        elapsed = t - self.last_time
-        ctx_switches = values.ctx_switches - self.last_values.ctx_switches
-        interrupts = values.interrupts - self.last_values.interrupts
-
-        if psutil.MACOS:
-            # not sure what these numbers mean exactly on mac
-            # see https://github.com/giampaolo/psutil/issues/847
-            # and https://developer.apple.com/documentation/kernel/1502546-host_statistics
-            csw_rate = pretty_bytes(values.ctx_switches, 5)
-            int_rate = pretty_bytes(values.interrupts, 5)
-        else:
-            csw_rate = pretty_bytes(ctx_switches / elapsed, 5)
-            int_rate = pretty_bytes(interrupts / elapsed, 5)
 
-        result = "%s %s" % (int_rate, csw_rate)
+def plugin_collectors():
+    """
+    Returns CollectorSpecs for the collectors installed as entry points, by
+    name, without importing them.
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # python < 3.8
+        return {}
+    entry_points = entry_points()
+    if hasattr(entry_points, "select"):
+        entry_points = entry_points.select(group=PLUGIN_GROUP)
+    else:  # python < 3.10
+        entry_points = entry_points.get(PLUGIN_GROUP, [])
+    return {
+        ep.name: CollectorSpec(
+            ("--" + ep.name,),
+            "%s (from %s)" % (ep.name, ep.value),
+            lambda _, ep=ep: [ep.load()()],
+        )
+        for ep in entry_points
+        if ep.name not in COLLECTORS
+    }
 
-        self.last_values = values
 
-        return result
+def field_names(stat):
+    """
+    Returns names for the values of collector `stat`, from its headers,
+    e.g. "dsk/total:read".
+    """
+    group = stat.header0().strip("-")
+    return [group + ":" + header.strip() for header in stat.header1()]
 
 
 class Dstat:
-    def __init__(self):
+    def __init__(
+        self, stats, debug=False, backend=None, color=True, quiet=False, writer=None
+    ):
+        """
+        Shows `stats`, a list of collectors, on the terminal unless `quiet`,
+        and records their raw values with `writer` (a RecordWriter) if
+        given.
+        """
+        self.debug = debug
         self.header_interval = shutil.get_terminal_size(fallback=(80, 25)).lines - 3
-        self.stats = [
-            Time(),
-            LoadAvgs(),
-            CpuTimes(),
-            DiskStats(),
-            NetStats(),
-            MemUsages(),
-            Paging(),
-            # System(),
-        ]
+        self.stats = stats
+        self.color = color
+        self.quiet = quiet
+        self.writer = writer
+        self.renderer = RowRenderer([stat.cells for stat in self.stats], color)
+        self.sampler = Sampler(
+            (source for stat in self.stats for source in stat.sources), backend
+        )
+        self.last_snapshot = self.sampler.sample()
 
-    def run(self):
-        time.sleep(0.2)
-        start = time.time()
+    def run(self, delay=1.0, count=None):
+        """
+        Prints (and/or records) a line of stats every `delay` seconds
+        (which can be fractional), `count` times or forever. Ticks are scheduled on the
+        monotonic clock at fixed offsets from the start, so they don't
+        drift; if a tick is late by more than a tenth of `delay` (at most
+        0.1s) it is skipped and reported as missed on the next line.
+        """
+        time.sleep(min(0.2, delay))
+        tolerance = min(0.1, delay / 10)
+        start = time.monotonic()
         row = 0
         i = 0
+        lines = 0
         missed_ticks = 0
         while True:
-            if row % self.header_interval == 0:
+            if row % self.header_interval == 0 and not self.quiet:
                 self.print_header()
                 row = 0
             self.print_stats_line(missed_ticks)
             row += 1
+            lines += 1
+            if count is not None and lines >= count:
+                break
             while True:
-                next_i = int(time.time() - start + 1)
-                next_due = start + next_i
-                time.sleep(max(0, next_due - time.time()))
-                if time.time() - next_due < 0.1:
+                next_i = int((time.monotonic() - start) / delay) + 1
+                next_due = start + next_i * delay
+                time.sleep(max(0, next_due - time.monotonic()))
+                if time.monotonic() - next_due < tolerance:
                     break
             missed_ticks = next_i - (i + 1)
             i = next_i
 
-    COLUMN_DELIM = BLUE + "|" + RESET
-
     def print_header(self):
-        header0 = BLUE + " ".join(stat.header0() for stat in self.stats) + RESET
-
-        substat_delim = RESET + " " + BLUE + UNDERLINE + BOLD
-        header1 = Dstat.COLUMN_DELIM.join(
-            (BLUE + UNDERLINE + BOLD + substat_delim.join(stat.header1()) + RESET)
-            for stat in self.stats
-        )
+        header0 = " ".join(stat.header0() for stat in self.stats)
+        if self.color:
+            header0 = BLUE + header0 + RESET
+            substat_delim = RESET + " " + BLUE + UNDERLINE + BOLD
+            header1 = RowRenderer.COLUMN_DELIM.join(
+                (BLUE + UNDERLINE + BOLD + substat_delim.join(stat.header1()) + RESET)
+                for stat in self.stats
+            )
+        else:
+            header1 = "|".join(" ".join(stat.header1()) for stat in self.stats)
 
         print(header0)
         print(header1)
 
     def print_stats_line(self, missed_ticks):
-        line = Dstat.COLUMN_DELIM.join(stat.value() for stat in self.stats)
+        snapshot = self.sampler.sample()
+        values = [stat.value(snapshot, self.last_snapshot) for stat in self.stats]
+        self.last_snapshot = snapshot
+        if self.writer:
+            self.writer.write(
+                list(itertools.chain.from_iterable(values)), snapshot.time
+            )
+        if self.quiet:
+            return
+        line = self.renderer.render(values)
+        if self.debug:
+            # time spent sampling and formatting this line
+            overhead = time.monotonic() - snapshot.time
+            line += self.renderer.grey + " %.2fms" % (overhead * 1000)
+            line += self.renderer.reset
         if missed_ticks == 1:
             line += " missed 1 tick"
         elif missed_ticks > 1:
@@ -500,6 +989,25 @@ class Dstat:
 #     return False
 
 
+def positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("must be greater than 0")
+    return value
+
+
+def parse_cpus(value):
+    cpus = value.split(",")
+    for cpu in cpus:
+        if cpu != TOTAL and not cpu.isdigit():
+            raise argparse.ArgumentTypeError("not a cpu number: %r" % cpu)
+    return cpus
+
+
+def parse_devices(value):
+    return value.split(",")
+
+
 def main(argv=None):
     argv = argv or sys.argv
     arg_parser = argparse.ArgumentParser(
@@ -507,12 +1015,131 @@ def main(argv=None):
         description="dstat.py - psutil version of dstat",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
+    arg_parser.add_argument(
+        "delay",
+        nargs="?",
+        type=positive_float,
+        default=1.0,
+        help="seconds between updates, can be fractional (e.g. 0.1)",
+    )
+    arg_parser.add_argument(
+        "count",
+        nargs="?",
+        type=int,
+        help="number of updates to print before exiting, or forever if None",
+    )
+    arg_parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="show the time taken to sample and format each line",
+    )
+    collectors = {**COLLECTORS, **plugin_collectors()}
+    group = arg_parser.add_argument_group(
+        "collectors",
+        "stats to show, in the order given (default: %s)"
+        % " ".join(COLLECTORS[name].flags[0] for name in DEFAULT_COLLECTORS),
+    )
+    for name, spec in collectors.items():
+        group.add_argument(
+            *spec.flags,
+            dest="collectors",
+            action="append_const",
+            const=name,
+            default=argparse.SUPPRESS,
+            help=spec.help,
+        )
+    arg_parser.add_argument(
+        "-C",
+        dest="cpus",
+        type=parse_cpus,
+        default=[TOTAL],
+        metavar="0,3,total",
+        help="cpus to show usage of, separately",
+    )
+    arg_parser.add_argument(
+        "-D",
+        dest="disks",
+        type=parse_devices,
+        default=[TOTAL],
+        metavar="sda,total",
+        help="disks to show throughput of, separately",
+    )
+    arg_parser.add_argument(
+        "-N",
+        dest="nics",
+        type=parse_devices,
+        default=[TOTAL],
+        metavar="eth1,total",
+        help="network interfaces to show throughput of, separately",
+    )
+    arg_parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help=(
+            "how to read system stats; by default procfs (reading /proc "
+            "directly) on linux, otherwise psutil"
+        ),
+    )
+    arg_parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help="also record raw values (e.g. bytes per second) to this file",
+    )
+    arg_parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help="format for --output (default: jsonl if PATH ends in .jsonl, else csv)",
+    )
+    arg_parser.add_argument(
+        "--no-color",
+        dest="color",
+        action="store_false",
+        help="print without ansi colors",
+    )
+    arg_parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="don't print anything, only record to --output",
+    )
     args = arg_parser.parse_args(args=argv[1:])
+    if args.quiet and not args.output:
+        arg_parser.error("--quiet needs --output")
 
     signal.signal(signal.SIGQUIT, lambda s, f: sys.exit(0))
     signal.signal(signal.SIGINT, lambda s, f: sys.exit(0))
 
-    Dstat().run()
+    stats = []
+    for name in getattr(args, "collectors", DEFAULT_COLLECTORS):
+        for stat in collectors[name].create(args):
+            unknown = [s for s in stat.sources if not callable(s) and s not in SOURCES]
+            if unknown:
+                arg_parser.error(
+                    "collector %s needs unknown source %s (choose from %s)"
+                    % (name, ", ".join(map(repr, unknown)), ", ".join(SOURCES))
+                )
+            stats.append(stat)
+    writer = None
+    if args.output:
+        output_format = args.output_format or (
+            "jsonl" if args.output.endswith(".jsonl") else "csv"
+        )
+        fields = [name for stat in stats for name in field_names(stat)]
+        writer = RecordWriter(args.output, output_format, fields)
+    dstat = Dstat(
+        stats,
+        debug=args.debug,
+        backend=args.backend,
+        color=args.color,
+        quiet=args.quiet,
+        writer=writer,
+    )
+    try:
+        dstat.run(args.delay, args.count)
+    finally:
+        # including on SIGINT/SIGQUIT, which exit via SystemExit
+        if writer:
+            writer.close()
 
 
 if __name__ == "__main__":
@@ -1,89 +1,671 @@
 #!/usr/bin/env python
 import argparse
+import bisect
+import functools
+import itertools
 import os
+import re
+import shutil
+import signal
 import subprocess
 import sys
-from collections import defaultdict
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import NamedTuple
 
 import psutil
 
+if psutil.POSIX:
+    import pwd
 
-class TreeNode(NamedTuple):
-    proc: psutil.Process
-    children: list
+
+class ProcessTree:
+    """
+    A process tree stored flat. `procs` is sorted by pid, `parents[i]` is
+    the index of the parent of `procs[i]` (or -1), and the indexes of the
+    children of `procs[i]`, in pid order, are
+    `children[child_start[i]:child_start[i + 1]]`.
+    """
+
+    def __init__(self, procs, index_by_pid, parents, child_start, children, roots):
+        self.procs = procs
+        self.index_by_pid = index_by_pid
+        self.parents = parents
+        self.child_start = child_start
+        self.children = children
+        self.roots = roots
+
+    def walk_indexes(self, roots=None, limit=None):
+        """
+        Yields (index, depth) for every process reachable from `roots`
+        (indexes, by default the roots of the tree), depth first with
+        children in order (pid order unless `sort_children()` was called).
+        Only the first `limit` roots and children of each process are
+        visited, if given. Iterative, so arbitrarily deep trees are fine.
+        """
+        child_start, children = self.child_start, self.children
+        roots = self.roots if roots is None else roots
+        stack = [(i, 0) for i in reversed(roots[:limit])]
+        while stack:
+            i, depth = stack.pop()
+            yield i, depth
+            end = child_start[i + 1]
+            if limit is not None:
+                end = min(end, child_start[i] + limit)
+            for child in reversed(children[child_start[i] : end]):
+                stack.append((child, depth + 1))
+
+    def walk(self, roots=None, limit=None):
+        """
+        Like `walk_indexes()`, but yields (proc, depth).
+        """
+        procs = self.procs
+        for i, depth in self.walk_indexes(roots, limit):
+            yield procs[i], depth
+
+    def sort_children(self, key, reverse=False):
+        """
+        Reorders the roots and each process's children by `key(index)`.
+        """
+        self.roots = sorted(self.roots, key=key, reverse=reverse)
+        child_start, children = self.child_start, self.children
+        for i in range(len(self.procs)):
+            start, end = child_start[i], child_start[i + 1]
+            if end - start > 1:
+                children[start:end] = array(
+                    "i", sorted(children[start:end], key=key, reverse=reverse)
+                )
+
+
+def break_cycles(parents):
+    """
+    Makes the lowest index in each cycle of `parents` a root. Cycles can
+    only come from pid reuse while the process table was being read (a
+    process's parent exits and its pid goes to one of its descendants).
+    """
+    state = bytearray(len(parents))  # 0 unseen, 1 on current path, 2 done
+    for i in range(len(parents)):
+        path = []
+        j = i
+        while j >= 0 and state[j] == 0:
+            state[j] = 1
+            path.append(j)
+            j = parents[j]
+        if j >= 0 and state[j] == 1:
+            parents[min(path[path.index(j) :])] = -1
+        for j in path:
+            state[j] = 2
 
 
 def build_process_tree(procs: list):
-    children_by_ppid = defaultdict(list)
-    proc_by_pid = {}
-    for proc in procs:
+    """
+    Builds a `ProcessTree` from the processes from `psutil.process_iter()`
+    (with "ppid" in `info`). Every process ends up in the tree exactly once:
+    processes whose parent is not in `procs` (it exited, or is outside our
+    pid namespace) or whose ppid could not be read are roots, alongside
+    pid 0 and/or 1.
+    """
+    procs = sorted(procs, key=lambda proc: proc.pid)
+    index_by_pid = {proc.pid: i for i, proc in enumerate(procs)}
+    n = len(procs)
+
+    parents = array("i", [-1]) * n
+    for i, proc in enumerate(procs):
+        parent = index_by_pid.get(proc.info.get("ppid"), -1)
+        if parent != i:
+            parents[i] = parent
+    break_cycles(parents)
+
+    # counting sort of the children by parent; since procs are in pid order
+    # each parent's children end up in pid order
+    child_start = array("i", [0]) * (n + 1)
+    for parent in parents:
+        if parent >= 0:
+            child_start[parent + 1] += 1
+    for i in range(n):
+        child_start[i + 1] += child_start[i]
+    children = array("i", [0]) * child_start[n]
+    next_slot = array("i", child_start)
+    for i, parent in enumerate(parents):
+        if parent >= 0:
+            children[next_slot[parent]] = i
+            next_slot[parent] += 1
+
+    roots = [i for i, parent in enumerate(parents) if parent < 0]
+    return ProcessTree(procs, index_by_pid, parents, child_start, children, roots)
+
+
+# metric -> (psutil attribute, function of info returning the metric)
+ROLLUPS = {
+    "cpu": ("cpu_percent", lambda info: info["cpu_percent"] or 0.0),
+    "rss": (
+        "memory_info",
+        lambda info: info["memory_info"].rss if info["memory_info"] else 0,
+    ),
+    "threads": ("num_threads", lambda info: info["num_threads"] or 0),
+    "fds": ("num_fds", lambda info: info["num_fds"] or 0),
+}
+
+
+def rollup(process_tree: ProcessTree, metrics=ROLLUPS):
+    """
+    Sets `info["tree_<metric>"]` on every process to the total of each of
+    `metrics` (names from ROLLUPS) over the process's whole subtree, in one
+    post-order pass. Returns {metric: array of totals by tree index}.
+    """
+    procs, parents = process_tree.procs, process_tree.parents
+    # reversed preorder visits every child before its parent
+    postorder = [i for i, _ in process_tree.walk_indexes()]
+    postorder.reverse()
+
+    totals = {}
+    for metric in metrics:
+        value = ROLLUPS[metric][1]
+        tree_totals = array("d", (value(proc.info) for proc in procs))
+        for i in postorder:
+            if parents[i] >= 0:
+                tree_totals[parents[i]] += tree_totals[i]
+        for proc, total in zip(procs, tree_totals):
+            proc.info["tree_" + metric] = total
+        totals[metric] = tree_totals
+    return totals
+
+
+def _format_percent(value):
+    return f"{value: 5.1f}" if value is not None else "    ?"
+
+
+def _format_cmd(info):
+    return (
+        subprocess.list2cmdline(info["cmdline"])
+        if info["cmdline"]
+        else (info["name"] or "?")
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_timestamp(seconds):
+    return f"{datetime.utcfromtimestamp(seconds):%Y-%m-%d %H:%M:%S}"
+
+
+def _format_started(info):
+    if info["create_time"] is None:
+        return "?"
+    # most processes start at the same few seconds (e.g. boot), so format
+    # each second once
+    return _format_timestamp(int(info["create_time"]))
+
+
+@functools.lru_cache(maxsize=None)
+def _username(uid):
+    # same as psutil.Process.username(), but looked up once per uid
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+def _format_kib(value):
+    return f"{value // 1024:.0f}" if value is not None else "?"
+
+
+def _format_user(info):
+    if "uids" in info:
+        return _username(info["uids"].real) if info["uids"] else "?"
+    return info["username"] or "?"
+
+
+class Column(NamedTuple):
+    header: str
+    width: int  # right-aligned to this width; 0 for the command
+    attrs: tuple  # psutil attributes needed to format it
+    format: callable  # info dict -> str
+
+
+COLUMNS = {
+    "user": Column(
+        "USER", 5, ("uids",) if psutil.POSIX else ("username",), _format_user
+    ),
+    "pid": Column("PID", 5, ("pid",), lambda info: info["pid"]),
+    "ppid": Column("PPID", 5, ("ppid",), lambda info: info["ppid"] or "?"),
+    "nice": Column("NIC", 3, ("nice",), lambda info: info["nice"] or "?"),
+    "%cpu": Column(
+        "%CPU", 5, ("cpu_percent",), lambda info: _format_percent(info["cpu_percent"])
+    ),
+    "%mem": Column(
+        "%MEM",
+        5,
+        ("memory_percent",),
+        lambda info: _format_percent(info["memory_percent"]),
+    ),
+    "nlwp": Column("#TH", 5, ("num_threads",), lambda info: info["num_threads"] or "?"),
+    "nfds": Column("#FILE", 5, ("num_fds",), lambda info: info["num_fds"] or "?"),
+    "start": Column("STARTED", 19, ("create_time",), _format_started),
+    "rss": Column(
+        "RSS",
+        8,
+        ("memory_info",),
+        lambda info: _format_kib(info["memory_info"] and info["memory_info"].rss),
+    ),
+    "cmd": Column("COMMAND", 0, ("cmdline", "name"), _format_cmd),
+    # totals over each process's subtree, filled in by rollup()
+    "t%cpu": Column(
+        "T%CPU", 6, ("cpu_percent",), lambda info: f"{info['tree_cpu']:6.1f}"
+    ),
+    "trss": Column(
+        "TRSS", 10, ("memory_info",), lambda info: _format_kib(info["tree_rss"])
+    ),
+    "tnlwp": Column(
+        "T#TH", 6, ("num_threads",), lambda info: f"{info['tree_threads']:.0f}"
+    ),
+    "tnfds": Column("T#FILE", 7, ("num_fds",), lambda info: f"{info['tree_fds']:.0f}"),
+}
+ROLLUP_COLUMNS = {"t%cpu": "cpu", "trss": "rss", "tnlwp": "threads", "tnfds": "fds"}
+COLUMN_ALIASES = {
+    "ni": "nice",
+    "pcpu": "%cpu",
+    "pmem": "%mem",
+    "thcount": "nlwp",
+    "lstart": "start",
+    "args": "cmd",
+    "command": "cmd",
+}
+DEFAULT_COLUMNS = [
+    "user",
+    "pid",
+    "ppid",
+    "nice",
+    "%cpu",
+    "%mem",
+    "nlwp",
+    "nfds",
+    "start",
+    "cmd",
+]
+
+
+def parse_columns(value):
+    """
+    Parses a comma-separated list of column names, like `ps -o`.
+    """
+    columns = []
+    for name in value.split(","):
+        name = COLUMN_ALIASES.get(name.strip().lower(), name.strip().lower())
+        if name not in COLUMNS:
+            raise argparse.ArgumentTypeError(
+                f"unknown column {name!r} (choose from {', '.join(COLUMNS)})"
+            )
+        columns.append(name)
+    return columns
+
+
+def column_attrs(columns):
+    """
+    Returns the psutil attributes to collect to build the tree and show
+    `columns`.
+    """
+    attrs = {"pid", "ppid"}
+    for name in columns:
+        attrs.update(COLUMNS[name].attrs)
+    return sorted(attrs)
+
+
+CONTROL_CHARS = dict.fromkeys(range(32), " ")
+
+
+def print_tree(
+    process_tree: ProcessTree,
+    columns=DEFAULT_COLUMNS,
+    user_max_width=5,
+    out=sys.stdout,
+    rows_per_write=4096,
+    limit=None,
+    max_rows=None,
+    max_width=None,
+):
+    """
+    Prints `columns` (names from COLUMNS) for each process in the tree, with
+    the command indented to show the tree structure. Rows are written to
+    `out` in chunks of `rows_per_write`. If `limit` is given only the first
+    `limit` roots and children of each process are shown, and if `max_rows`
+    is given only that many processes are shown. If `max_width` is given
+    rows are cut to that many characters, with control characters (e.g.
+    newlines in command lines) shown as spaces, so each takes one line.
+    """
+    widths = [
+        user_max_width if name == "user" else COLUMNS[name].width for name in columns
+    ]
+    formats = [COLUMNS[name].format for name in columns]
+    cells = list(zip(formats, widths))
+
+    header = " ".join(
+        f"{COLUMNS[name].header:>{width}}" for name, width in zip(columns, widths)
+    )
+    rows = [header[:max_width]]
+    for proc, depth in itertools.islice(process_tree.walk(limit=limit), max_rows):
+        info = proc.info
+        row = " ".join(
+            f"{format(info):>{width}}" if width else "  " * depth + format(info)
+            for format, width in cells
+        )
+        if max_width is not None:
+            row = row.translate(CONTROL_CHARS)[:max_width]
+        rows.append(row)
+        if len(rows) >= rows_per_write:
+            rows.append("")
+            out.write("\n".join(rows))
+            rows.clear()
+    rows.append("")
+    out.write("\n".join(rows))
+    out.flush()
+
+
+CLEAR_SCREEN = "\033[H\033[2J"
+
+
+class ProcInfo(NamedTuple):
+    """
+    Stands in for a `psutil.Process` from `psutil.process_iter()`, for
+    processes whose info was collected in another process.
+    """
+
+    pid: int
+    info: dict
+
+
+def _collect_infos(pids, attrs):
+    infos = []
+    for pid in pids:
         try:
-            children_by_ppid[proc.ppid()].append(proc.pid)
-            proc_by_pid[proc.pid] = proc
+            # as_dict() reads all the attributes inside Process.oneshot()
+            infos.append(psutil.Process(pid).as_dict(attrs, ad_value=None))
         except psutil.NoSuchProcess:
             pass
+    return infos
+
+
+def collect_procs(attrs, jobs=1, procs=None):
+    """
+    Returns a list of processes with `attrs` in their `info`, like
+    `list(psutil.process_iter(attrs))`, or only for `procs` (a list of
+    `psutil.Process`) if given. With `jobs` > 1 the pids are split across
+    that many worker processes and the results are returned as `ProcInfo`s.
+    """
+    if jobs <= 1 and procs is None:
+        return list(psutil.process_iter(attrs))
+    elif jobs <= 1:
+        collected = []
+        for proc in procs:
+            try:
+                proc.info = proc.as_dict(attrs, ad_value=None)
+                collected.append(proc)
+            except psutil.NoSuchProcess:
+                pass
+        return collected
+
+    attrs = list(set(attrs) | {"pid"})
+    pids = psutil.pids() if procs is None else [proc.pid for proc in procs]
+    # interleave, so that every worker gets a mix of old and new processes
+    chunks = [pids[i::jobs] for i in range(jobs)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(_collect_infos, chunks, [attrs] * jobs)
+        return [ProcInfo(info["pid"], info) for infos in results for info in infos]
+
+
+def _cpu_times_snapshot(procs=None):
+    """
+    Returns {(pid, create_time): user + system cpu seconds} for `procs`, or
+    for every process if None.
+    """
+    attrs = ["create_time", "cpu_times"]
+    snapshot = {}
+    for proc in collect_procs(attrs, procs=procs):
+        cpu_times = proc.info["cpu_times"]
+        if cpu_times is not None:
+            snapshot[(proc.pid, proc.info["create_time"])] = (
+                cpu_times.user + cpu_times.system
+            )
+    return snapshot
+
+
+def sample_cpu_percents(interval, procs=None):
+    """
+    Returns {(pid, create_time): cpu_percent} for `procs` (a list of
+    `psutil.Process`), or for every process if None, measured over a
+    single `interval` seconds shared by all of them. Keying by
+    create_time means a reused pid is not mistaken for the old process.
+    Processes born during the interval are measured from their start, and
+    ones that exit during it are left out.
+    """
+    before = _cpu_times_snapshot(procs)
+    start = time.monotonic()
+    time.sleep(interval)
+    after = _cpu_times_snapshot(procs)
+    elapsed = time.monotonic() - start
+    now = time.time()
+
+    cpu_percents = {}
+    for key, cpu_time in after.items():
+        if key in before:
+            cpu_percents[key] = (cpu_time - before[key]) / elapsed * 100
+        else:
+            lifetime = min(max(now - key[1], 0.001), elapsed)
+            cpu_percents[key] = cpu_time / lifetime * 100
+    return cpu_percents
+
+
+# attributes that change while a process runs, re-read on every --watch tick
+DYNAMIC_ATTRS = {
+    "cpu_percent",
+    "memory_percent",
+    "memory_info",
+    "num_threads",
+    "num_fds",
+    "nice",
+}
+
+
+class LiveProcessTree:
+    """
+    A process tree that is kept up to date from tick to tick (see --watch).
+    Each tick only the births and exits since the last tick are read, and
+    the static attributes (command line, user, start time) are read once
+    per process. Dynamic attributes are read by `refresh()`, only for the
+    processes that are going to be shown.
 
-    def add_children_recursively(parent_node: TreeNode):
-        for pid in sorted(children_by_ppid[parent_node.proc.pid]):
-            if pid == parent_node.proc.pid:
+    Processes are `psutil.Process` objects, kept for as long as the process
+    lives, which is also what makes `cpu_percent()` meaningful from one
+    tick to the next. A reused pid is noticed when its start time no
+    longer matches (`Process.is_running()`).
+    """
+
+    def __init__(self, attrs):
+        self.static_attrs = sorted(set(attrs) - DYNAMIC_ATTRS | {"pid", "ppid"})
+        self.dynamic_attrs = sorted(set(attrs) & DYNAMIC_ATTRS)
+        self.procs = {}  # pid -> psutil.Process
+        self.parents = {}  # pid -> parent pid in the tree, or None for roots
+        self.children = {}  # pid -> sorted list of child pids
+        self.roots = []  # sorted list of pids
+
+    def _attach(self, pid):
+        ppid = self.procs[pid].info["ppid"]
+        parent = ppid if ppid in self.procs else None
+        # like build_process_tree(), a process that would be its own
+        # ancestor is a root: pid 0 on macOS has ppid 0, and pid reuse can
+        # make cycles
+        ancestor = parent
+        while ancestor is not None and ancestor != pid:
+            ancestor = self.parents.get(ancestor)
+        if ancestor == pid:
+            parent = None
+        self.parents[pid] = parent
+        siblings = self.roots if parent is None else self.children[parent]
+        bisect.insort(siblings, pid)
+
+    def _detach(self, pid):
+        parent = self.parents.pop(pid)
+        siblings = self.roots if parent is None else self.children[parent]
+        siblings.remove(pid)
+
+    def _remove(self, pid):
+        self._detach(pid)
+        orphans = self.children.pop(pid)
+        del self.procs[pid]
+        # the orphans have been reparented (to init or a subreaper)
+        for child in orphans:
+            try:
+                self.procs[child].info["ppid"] = self.procs[child].ppid()
+            except psutil.NoSuchProcess:
+                self.procs[child].info["ppid"] = None
+            self._attach(child)
+
+    def _add(self, pids):
+        born = []
+        for pid in pids:
+            try:
+                proc = psutil.Process(pid)
+                proc.info = proc.as_dict(self.static_attrs, ad_value=None)
+                proc.info.update(dict.fromkeys(self.dynamic_attrs))
+            except psutil.NoSuchProcess:
                 continue
-            proc = proc_by_pid[pid]
-            child_node = TreeNode(proc, [])
-            parent_node.children.append(child_node)
-            add_children_recursively(child_node)
+            self.procs[pid] = proc
+            self.children[pid] = []
+            born.append(pid)
+        # only once they are all in self.procs, so that children born in
+        # the same tick find their parents
+        for pid in born:
+            self._attach(pid)
 
-    if 0 in proc_by_pid:
-        root = TreeNode(proc_by_pid[0], [])
-    else:
-        root = TreeNode(proc_by_pid[1], [])
-    add_children_recursively(root)
+    def update(self):
+        """
+        Applies the births and exits since the last update.
+        """
+        pids = set(psutil.pids())
+        for pid in self.procs.keys() - pids:
+            self._remove(pid)
+        self._add(sorted(pids - self.procs.keys()))
 
-    return root
+    def walk(self, roots=None, limit=None):
+        """
+        Yields (proc, depth) like `ProcessTree.walk()`, with `roots` and
+        children given as pids.
+        """
+        roots = self.roots if roots is None else roots
+        stack = [(pid, 0) for pid in reversed(roots[:limit])]
+        while stack:
+            pid, depth = stack.pop()
+            yield self.procs[pid], depth
+            for child in reversed(self.children[pid][:limit]):
+                stack.append((child, depth + 1))
 
+    def refresh(self, max_rows):
+        """
+        Re-reads the dynamic attributes of the first `max_rows` processes
+        that `walk()` yields.
+        """
+        reused = []
+        for proc, _ in list(itertools.islice(self.walk(), max_rows)):
+            try:
+                if not proc.is_running():
+                    reused.append(proc.pid)
+                    continue
+                proc.info.update(proc.as_dict(self.dynamic_attrs, ad_value=None))
+            except psutil.NoSuchProcess:
+                pass  # gone from psutil.pids() next update
+        for pid in reused:
+            self._remove(pid)
+        self._add(reused)
 
-def print_tree(process_tree: TreeNode, user_max_width=5):
-    print(
-        f"{'USER':>{user_max_width}} {'PID':>5} {'PPID':>5} {'NIC':>3} {'%CPU':>5} {'%MEM':>5} {'#TH':>5} "
-        f"{'#FILE':>5} {'STARTED':>19} COMMAND"
-    )
 
-    def _print_tree(node: TreeNode, indent: int = 0):
-        info = node.proc.info
-        cpu_percent_str = (
-            f"{info['cpu_percent']: 5.1f}"
-            if info["cpu_percent"] is not None
-            else "    ?"
-        )
-        memory_percent_str = (
-            f"{info['memory_percent']: 5.1f}"
-            if info["memory_percent"] is not None
-            else "    ?"
-        )
-        cmd_str = (
-            subprocess.list2cmdline(info["cmdline"])
-            if info["cmdline"]
-            else (info["name"] or "?")
-        )
-        print(
-            f"{info['username'] or '?':>{user_max_width}} "
-            f"{info['pid']:>5} "
-            f"{info['ppid'] or '?':>5} "
-            f"{info['nice'] or '?':>3} "
-            f"{cpu_percent_str} "
-            f"{memory_percent_str} "
-            f"{info['num_threads'] or '?':>5} "
-            f"{info['num_fds'] or '?':>5} "
-            f"{datetime.utcfromtimestamp(info['create_time']):%Y-%m-%d %H:%M:%S} "
-            f"{' '*indent}"
-            f"{cmd_str}"
+def watch(interval, columns, out=sys.stdout):
+    """
+    Redraws the process tree, as much as fits in the terminal, with rows cut
+    to its width, every `interval` seconds.
+    """
+    tree = LiveProcessTree(column_attrs(columns))
+    next_due = time.monotonic()
+    while True:
+        tree.update()
+        size = shutil.get_terminal_size(fallback=(80, 25))
+        max_rows = size.lines - 2
+        tree.refresh(max_rows)
+
+        user_max_width = 5
+        if "user" in columns:
+            user_max_width = max(
+                [
+                    len(_format_user(proc.info))
+                    for proc, _ in itertools.islice(tree.walk(), max_rows)
+                ],
+                default=5,
+            )
+        out.write(CLEAR_SCREEN)
+        print_tree(
+            tree,
+            columns,
+            user_max_width,
+            out,
+            max_rows=max_rows,
+            max_width=size.columns,
         )
 
-        for child in node.children:
-            _print_tree(child, indent + 2)
+        next_due += interval
+        time.sleep(max(0, next_due - time.monotonic()))
+
 
-    _print_tree(process_tree)
+def select_procs(pid=None, uids=None, pattern=None):
+    """
+    Returns the processes (as `psutil.Process`) that are in the subtree
+    rooted at `pid`, are owned by (real uid) one of `uids`, and have a name
+    matching the regex `pattern`, ignoring any criterion that is None. Only
+    reads the attributes needed to decide, so that the expensive ones can
+    be collected afterwards just for the selected processes.
+    """
+    attrs = ["pid", "ppid"]
+    if uids:
+        attrs.append("uids")
+    if pattern:
+        attrs.append("name")
+    procs = list(psutil.process_iter(attrs))
+
+    if pid is not None:
+        tree = build_process_tree(procs)
+        if pid not in tree.index_by_pid:
+            return []
+        procs = [proc for proc, _ in tree.walk([tree.index_by_pid[pid]])]
+    if uids:
+        procs = [
+            proc
+            for proc in procs
+            if proc.info["uids"] and proc.info["uids"].real in uids
+        ]
+    if pattern:
+        procs = [
+            proc
+            for proc in procs
+            if proc.info["name"] and pattern.search(proc.info["name"])
+        ]
+    return procs
+
+
+def parse_user(value):
+    if not psutil.POSIX:
+        raise argparse.ArgumentTypeError("only supported on POSIX systems")
+    if value.isdigit():
+        return int(value)
+    try:
+        return pwd.getpwnam(value).pw_uid
+    except KeyError:
+        raise argparse.ArgumentTypeError(f"no such user {value!r}")
+
+
+def parse_regex(value):
+    try:
+        return re.compile(value)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"bad regex {value!r}: {e}")
 
 
 def main(argv=None):
@@ -93,31 +675,162 @@ def main(argv=None):
         prog=os.path.basename(argv[0]),
         description="something like ps -fHe but portable",
     )
-    arg_parser.parse_args(args=argv[1:])
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="collect process information using this many worker processes",
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--columns",
+        type=parse_columns,
+        default=DEFAULT_COLUMNS,
+        help=(
+            "comma-separated columns to show, only these are collected "
+            f"(default: {','.join(DEFAULT_COLUMNS)})".replace("%", "%%")
+        ),
+    )
+    arg_parser.add_argument(
+        "-i",
+        "--interval",
+        metavar="SECONDS",
+        type=float,
+        help=(
+            "measure %%CPU over SECONDS (one interval for all processes); "
+            "without this %%CPU is not meaningful"
+        ),
+    )
+    arg_parser.add_argument(
+        "-p",
+        "--pid",
+        type=int,
+        help="only show the subtree rooted at process PID",
+    )
+    arg_parser.add_argument(
+        "-u",
+        "--user",
+        dest="uids",
+        metavar="USER",
+        action="append",
+        type=parse_user,
+        help="only show processes of USER (name or uid)",
+    )
+    arg_parser.add_argument(
+        "-m",
+        "--match",
+        metavar="REGEX",
+        type=parse_regex,
+        help="only show processes whose name matches REGEX",
+    )
+    rollup_group = arg_parser.add_argument_group(title="subtree totals")
+    rollup_group.add_argument(
+        "-r",
+        "--rollup",
+        action="store_true",
+        help=(
+            "show %%CPU, RSS, threads and open files totalled over each "
+            "process's subtree"
+        ),
+    )
+    rollup_group.add_argument(
+        "-s",
+        "--sort",
+        choices=ROLLUPS,
+        help="order siblings by this subtree total, largest first",
+    )
+    rollup_group.add_argument(
+        "-k",
+        "--top",
+        metavar="K",
+        type=int,
+        help=(
+            "only show the K largest subtrees at each level "
+            "(by the --sort total; by default cpu with --interval, "
+            "otherwise rss)"
+        ),
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--watch",
+        metavar="INTERVAL",
+        type=float,
+        help="like top, redraw the tree every INTERVAL seconds",
+    )
+    args = arg_parser.parse_args(args=argv[1:])
 
-    try:
-        procs = list(
-            psutil.process_iter(
-                [
-                    "pid",
-                    "username",
-                    "cmdline",
-                    "name",
-                    "num_threads",
-                    "num_fds",
-                    "cpu_percent",
-                    "memory_percent",
-                    "ppid",
-                    "nice",
-                    "create_time",
-                ]
+    if args.watch:
+        if (
+            args.rollup
+            or args.sort
+            or args.top
+            or args.interval
+            or args.pid is not None
+            or args.uids
+            or args.match
+        ):
+            arg_parser.error(
+                "--watch cannot be combined with subtree totals, filters or "
+                "--interval"
             )
+        signal.signal(signal.SIGQUIT, lambda s, f: sys.exit(0))
+        signal.signal(signal.SIGINT, lambda s, f: sys.exit(0))
+        try:
+            watch(args.watch, args.columns)
+        except BrokenPipeError:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+        return
+
+    if args.rollup:
+        # before the command, which is indented to show the tree
+        at = args.columns.index("cmd") if "cmd" in args.columns else len(args.columns)
+        args.columns = list(args.columns)
+        args.columns[at:at] = [c for c in ROLLUP_COLUMNS if c not in args.columns]
+    if args.top is not None and not args.sort:
+        args.sort = "cpu" if args.interval else "rss"
+    if args.sort == "cpu" and not args.interval:
+        arg_parser.error("sorting by cpu requires --interval")
+
+    try:
+        selected = None
+        if args.pid is not None or args.uids or args.match:
+            selected = select_procs(args.pid, args.uids, args.match)
+
+        metrics = {ROLLUP_COLUMNS[c] for c in args.columns if c in ROLLUP_COLUMNS}
+        if args.sort:
+            metrics.add(args.sort)
+        attrs = sorted(
+            set(column_attrs(args.columns)) | {ROLLUPS[m][0] for m in metrics}
         )
+        cpu_percents = None
+        if args.interval and "cpu_percent" in attrs:
+            cpu_percents = sample_cpu_percents(args.interval, selected)
+            attrs = sorted(set(attrs) - {"cpu_percent"} | {"create_time"})
+
+        procs = collect_procs(attrs, args.jobs, selected)
+        if cpu_percents is not None:
+            for proc in procs:
+                proc.info["cpu_percent"] = cpu_percents.get(
+                    (proc.pid, proc.info["create_time"])
+                )
         process_tree = build_process_tree(procs)
-        user_max_width = max(len(proc.info["username"]) for proc in procs)
-        print_tree(process_tree, user_max_width)
+        if metrics:
+            totals = rollup(process_tree, metrics)
+            if args.sort:
+                process_tree.sort_children(totals[args.sort].__getitem__, reverse=True)
+        user_max_width = 5
+        if "user" in args.columns:
+            user_max_width = max(
+                [len(_format_user(proc.info)) for proc in procs], default=5
+            )
+        print_tree(process_tree, args.columns, user_max_width, limit=args.top)
     except BrokenPipeError:
-        pass
+        # the reader went away (e.g. `ps.py | head`); point stdout at
+        # /dev/null so that flushing it at exit doesn't complain again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
 
 
 if __name__ == "__main__":
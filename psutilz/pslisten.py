@@ -10,11 +10,18 @@ found in the LICENSE file.
 from __future__ import print_function
 import psutil
 import socket
+import struct
 import subprocess
 import datetime
 import argparse
+import ipaddress
+import pwd
+import csv
+import json
 import sys
 import os
+import time
+from collections import namedtuple
 
 try:
     from socket import AddressFamily
@@ -27,14 +34,561 @@ except ImportError:
     SocketKind = socket
 
 
-def gather_info():
+# same shape as the connections returned by psutil.net_connections()
+addr = namedtuple("addr", ["ip", "port"])
+sconn = namedtuple("sconn", ["fd", "family", "type", "laddr", "raddr", "status", "pid"])
+
+
+def proto_name(family, type_):
+    """
+    Returns "TCP4", "TCP6", "UDP4" or "UDP6", or None for anything else.
+    """
+    if family == AddressFamily.AF_INET:
+        if type_ == SocketKind.SOCK_DGRAM:
+            return "UDP4"
+        elif type_ == SocketKind.SOCK_STREAM:
+            return "TCP4"
+    elif family == AddressFamily.AF_INET6:
+        if type_ == SocketKind.SOCK_DGRAM:
+            return "UDP6"
+        elif type_ == SocketKind.SOCK_STREAM:
+            return "TCP6"
+    return None
+
+
+# (file under /proc/net, family, type, st field value of listening rows)
+PROC_NET_FILES = [
+    ("tcp", AddressFamily.AF_INET, SocketKind.SOCK_STREAM, "0A"),  # TCP_LISTEN
+    ("tcp6", AddressFamily.AF_INET6, SocketKind.SOCK_STREAM, "0A"),
+    ("udp", AddressFamily.AF_INET, SocketKind.SOCK_DGRAM, "07"),  # TCP_CLOSE
+    ("udp6", AddressFamily.AF_INET6, SocketKind.SOCK_DGRAM, "07"),
+]
+
+
+def decode_proc_net_address(family, address):
+    """
+    Decodes an address like "0100007F:0277" from /proc/net/{tcp,udp}* into
+    an `addr` tuple. The kernel prints the ip as native-endian 32-bit words.
+    """
+    ip_hex, port_hex = address.split(":")
+    words = [int(ip_hex[i : i + 8], 16) for i in range(0, len(ip_hex), 8)]
+    packed = struct.pack("=%dI" % len(words), *words)
+    return addr(socket.inet_ntop(family, packed), int(port_hex, 16))
+
+
+def iter_proc_net_listeners(procfs="/proc"):
+    """
+    Yields (family, type, laddr, inode) for each listening tcp socket and
+    each unconnected udp socket in /proc/net/{tcp,tcp6,udp,udp6}. Rows in
+    any other state (i.e. established connections, which can number in the
+    hundreds of thousands) are skipped without decoding them.
+    """
+    for name, family, type_, listen_state in PROC_NET_FILES:
+        try:
+            f = open(os.path.join(procfs, "net", name))
+        except (FileNotFoundError, PermissionError):
+            continue  # e.g. ipv6 disabled
+        with f:
+            next(f, None)  # header
+            for line in f:
+                # sl local_address rem_address st ...
+                fields = line.split(None, 4)
+                if fields[3] != listen_state:
+                    continue
+                laddr = decode_proc_net_address(family, fields[1])
+                if laddr.port == 0:
+                    continue
+                inode = int(fields[4].split()[5])
+                yield family, type_, laddr, inode
+
+
+PF_KTHREAD = 0x00200000  # linux/sched.h
+
+
+class SocketOwnerIndex:
+    """
+    Maps socket inodes to the processes that have them open, by reading
+    /proc/<pid>/fd. What is learned is kept, so that repeated lookups (e.g.
+    in --watch mode) only do work for what changed in between: each
+    process's stat is read once, and its fds scanned once, unless a socket
+    shows up that no process was known to have; and sockets that no
+    process could be found for (kernel sockets, or processes we can't see)
+    are only looked for in processes that are new since.
+
+    A process is recognized from one lookup to the next by the inode of its
+    /proc/<pid> directory, which comes free with the directory listing;
+    if that changes its starttime is checked, so that pid reuse is noticed.
+
+    If `pids` is given, only those processes are looked at, and sockets
+    owned by any others are reported as having no owner.
+    """
+
+    def __init__(self, procfs="/proc", pids=None):
+        self.procfs = procfs
+        self.pids = set(pids) if pids else None
+        self.procs = {}  # pid -> (/proc/<pid> inode, starttime, ppid)
+        self.kthreads = {}  # pid -> /proc/<pid> inode
+        self.unscanned = set()  # pids whose fds haven't been scanned
+        self.scanned = set()  # pids whose fds have been scanned
+        self.owners = {}  # inode -> (pid, starttime, fd) of the owner found
+        self.ownerless = set()  # inodes no process was found for
+
+    def _read_stat(self, pid):
+        """
+        Returns (starttime, ppid, flags) from /proc/<pid>/stat, or None if
+        the process is gone.
+        """
+        try:
+            with open(os.path.join(self.procfs, str(pid), "stat"), "rb") as f:
+                stat = f.read()
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+        # comm can contain spaces and parens, so split after the last paren
+        fields = stat[stat.rindex(b")") + 2 :].split()
+        return int(fields[19]), int(fields[1]), int(fields[6])
+
+    def _scan_fds(self, pid):
+        """
+        Returns {inode: fd} for the sockets process `pid` has open.
+        """
+        sockets = {}
+        fd_dir = os.path.join(self.procfs, str(pid), "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except (FileNotFoundError, PermissionError, ProcessLookupError):
+            return sockets
+        for fd in fds:
+            try:
+                link = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if link.startswith("socket:["):
+                sockets[int(link[8:-1])] = int(fd)
+        return sockets
+
+    def _still_open(self, pid, fd, inode):
+        try:
+            link = os.readlink(os.path.join(self.procfs, str(pid), "fd", str(fd)))
+        except OSError:
+            return False
+        return link == "socket:[%s]" % inode
+
+    def _forget(self, pid):
+        self.procs.pop(pid, None)
+        self.kthreads.pop(pid, None)
+        self.unscanned.discard(pid)
+        self.scanned.discard(pid)
+
+    def _update_procs(self):
+        """
+        Brings `procs` up to date with the processes now running, reading
+        the stat only of those that are new.
+        """
+        dir_inodes = {}
+        with os.scandir(self.procfs) as entries:
+            for entry in entries:
+                if entry.name.isdigit():
+                    pid = int(entry.name)
+                    if self.pids is None or pid in self.pids:
+                        dir_inodes[pid] = entry.inode()
+
+        for pid in (self.procs.keys() | self.kthreads.keys()) - dir_inodes.keys():
+            self._forget(pid)
+
+        for pid, dir_inode in dir_inodes.items():
+            if pid in self.procs:
+                if self.procs[pid][0] == dir_inode:
+                    continue
+            elif self.kthreads.get(pid) == dir_inode:
+                continue
+            stat = self._read_stat(pid)
+            if stat is None:
+                self._forget(pid)
+                continue
+            starttime, ppid, flags = stat
+            if pid in self.procs and self.procs[pid][1] == starttime:
+                # same process, with its /proc entry made afresh
+                self.procs[pid] = (dir_inode, starttime, ppid)
+                continue
+            self._forget(pid)
+            if flags & PF_KTHREAD:
+                self.kthreads[pid] = dir_inode
+            else:
+                self.procs[pid] = (dir_inode, starttime, ppid)
+                self.unscanned.add(pid)
+
+    def _scan(self, pids, remaining, owners):
+        """
+        Scans the fds of `pids`, parents of everything (children of init)
+        first, until every one of `remaining` has an owner. Returns the pids
+        scanned.
+        """
+        order = sorted(pids, key=lambda pid: (self.procs[pid][2] not in (0, 1), pid))
+        scanned = []
+        for pid in order:
+            if not remaining:
+                break
+            scanned.append(pid)
+            sockets = self._scan_fds(pid)
+            self.scanned.add(pid)
+            self.unscanned.discard(pid)
+            for inode in remaining.intersection(sockets):
+                owners[inode] = [(pid, sockets[inode])]
+                self.owners[inode] = (pid, self.procs[pid][1], sockets[inode])
+            remaining.difference_update(sockets)
+        return scanned
+
+    def find_owners(self, inodes):
+        """
+        Returns a dict mapping each socket inode in `inodes` that could be
+        found in some process's fd table to a list of (pid, fd).
+
+        Stops scanning as soon as every inode has an owner, so a socket
+        shared by several processes (e.g. inherited by forked workers) is
+        reported against the first of them found, and then against that
+        same one for as long as it has it open. Remembered owners are tried
+        first, then processes that have not been scanned yet, then, only for
+        inodes not looked for before, processes that were scanned before, in
+        case they opened them since. Kernel threads are skipped.
+        """
+        self._update_procs()
+
+        owners = {}
+        remaining = set(inodes)
+        for inode in self.owners.keys() - remaining:
+            del self.owners[inode]  # no longer listening
+        for inode in remaining:
+            if inode in self.owners:
+                pid, starttime, fd = self.owners[inode]
+                proc = self.procs.get(pid)
+                if proc and proc[1] == starttime and self._still_open(pid, fd, inode):
+                    owners[inode] = [(pid, fd)]
+                else:
+                    del self.owners[inode]
+        remaining.difference_update(owners)
+
+        scanned = self._scan(self.unscanned, remaining, owners)
+        unsearched = remaining - self.ownerless
+        if unsearched:
+            rescan = self.scanned - set(scanned)
+            self._scan(rescan, unsearched, owners)
+            remaining.difference_update(owners)
+        self.ownerless = remaining
+
+        return owners
+
+
+def listeners_to_connections(listeners, owner_index=None):
     """
-    Returns a list of dicts with keys 'pid', 'cmdline', 'username', 'ppid',
-    'nice', 'cpu_percent', 'memory_percent', 'num_threads', 'started'.
+    Takes (family, type, laddr, inode) tuples and returns them in the form of
+    `psutil.net_connections()`, with the owning processes looked up in
+    `owner_index` (a `SocketOwnerIndex`).
+    """
+    owner_index = owner_index or SocketOwnerIndex()
+    listeners = list(listeners)
+    owners = owner_index.find_owners({inode for _, _, _, inode in listeners})
+
+    conns = []
+    for family, type_, laddr, inode in listeners:
+        status = (
+            psutil.CONN_LISTEN if type_ == SocketKind.SOCK_STREAM else psutil.CONN_NONE
+        )
+        for pid, fd in owners.get(inode) or [(None, -1)]:
+            conns.append(sconn(fd, family, type_, laddr, (), status, pid))
+    return conns
+
+
+# linux/netlink.h, linux/sock_diag.h, linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+TCP_LISTEN = 10
+TCP_CLOSE = 7
+
+# struct nlmsghdr
+NLMSGHDR = struct.Struct("=IHHII")
+# struct inet_diag_req_v2, with an all-zero inet_diag_sockid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")
+# struct inet_diag_msg; idiag_sport is in network byte order
+INET_DIAG_MSG = struct.Struct("=BBBB2s2s16s16sI8xIIIII")
+
+# (family, type, protocol, states) to dump
+SOCK_DIAG_QUERIES = [
+    (AddressFamily.AF_INET, SocketKind.SOCK_STREAM, socket.IPPROTO_TCP, TCP_LISTEN),
+    (AddressFamily.AF_INET6, SocketKind.SOCK_STREAM, socket.IPPROTO_TCP, TCP_LISTEN),
+    (AddressFamily.AF_INET, SocketKind.SOCK_DGRAM, socket.IPPROTO_UDP, TCP_CLOSE),
+    (AddressFamily.AF_INET6, SocketKind.SOCK_DGRAM, socket.IPPROTO_UDP, TCP_CLOSE),
+]
+
+
+def parse_netlink_messages(data):
+    """
+    Yields (nlmsg_type, payload) for each netlink message in `data`, which
+    is the result of one recv() on a netlink socket.
+    """
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, type_, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size or offset + length > len(data):
+            break  # malformed or truncated
+        yield type_, data[offset + NLMSGHDR.size : offset + length]
+        offset += (length + 3) & ~3  # NLMSG_ALIGN
+
+
+def parse_inet_diag_msg(family, payload):
+    """
+    Returns (laddr, inode) from the payload of a SOCK_DIAG_BY_FAMILY reply.
+    """
+    _, _, _, _, sport, _, src, _, _, _, _, _, _, inode = INET_DIAG_MSG.unpack_from(
+        payload
+    )
+    if family == AddressFamily.AF_INET:
+        src = src[:4]
+    return addr(socket.inet_ntop(family, src), int.from_bytes(sport, "big")), inode
+
+
+def iter_sock_diag_replies(family, recv):
+    """
+    Yields (laddr, inode) from the replies to a sock_diag dump, calling
+    `recv()` to get each buffer until the kernel says it is done.
+    """
+    while True:
+        data = recv()
+        if not data:
+            return
+        for type_, payload in parse_netlink_messages(data):
+            if type_ == NLMSG_DONE:
+                return
+            elif type_ == NLMSG_ERROR:
+                (error,) = struct.unpack_from("=i", payload)
+                if error:
+                    raise OSError(-error, os.strerror(-error))
+            elif type_ == SOCK_DIAG_BY_FAMILY:
+                yield parse_inet_diag_msg(family, payload)
+
+
+def iter_netlink_listeners():
+    """
+    Yields (family, type, laddr, inode) for each listening tcp socket and
+    each unconnected udp socket, asking the kernel over NETLINK_SOCK_DIAG
+    for only the sockets in those states. Raises OSError if sock_diag is
+    not available.
+    """
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG) as sock:
+        for seq, (family, type_, protocol, state) in enumerate(SOCK_DIAG_QUERIES):
+            request = INET_DIAG_REQ_V2.pack(family, protocol, 0, 1 << state)
+            header = NLMSGHDR.pack(
+                NLMSGHDR.size + len(request),
+                SOCK_DIAG_BY_FAMILY,
+                NLM_F_REQUEST | NLM_F_DUMP,
+                seq + 1,
+                0,
+            )
+            sock.sendall(header + request)
+            replies = iter_sock_diag_replies(family, lambda: sock.recv(65536))
+            for laddr, inode in replies:
+                if laddr.port > 0:
+                    yield family, type_, laddr, inode
+
+
+BACKENDS = ["psutil", "procfs", "netlink"]
+
+
+def listening_connections(backend=None, owner_index=None, listener_filter=None):
+    """
+    Returns listening sockets in the form of `psutil.net_connections()`.
+
+    `backend` is one of BACKENDS, or None to use the best one available.
+    The netlink backend falls back to procfs, and procfs falls back to
+    psutil, if they are not available on this system. `owner_index` is the
+    `SocketOwnerIndex` used by the netlink and procfs backends.
+
+    Sockets rejected by `listener_filter.wants_socket()` are dropped before
+    their owners are looked up, and with `listener_filter.pids` only those
+    processes' fds are scanned.
+    """
+    if owner_index is None and listener_filter is not None:
+        owner_index = SocketOwnerIndex(pids=listener_filter.pids)
+
+    def wanted(listeners):
+        if listener_filter is None:
+            return list(listeners)
+        return [
+            listener
+            for listener in listeners
+            if listener_filter.wants_socket(listener[0], listener[1], listener[2])
+        ]
+
+    if backend in (None, "netlink") and psutil.LINUX:
+        try:
+            # materialize here so that errors are caught here
+            listeners = wanted(iter_netlink_listeners())
+            return listeners_to_connections(listeners, owner_index)
+        except OSError:
+            pass
+    if backend != "psutil" and psutil.LINUX and os.path.exists("/proc/net/tcp"):
+        listeners = wanted(iter_proc_net_listeners())
+        return listeners_to_connections(listeners, owner_index)
+    return [
+        conn
+        for conn in psutil.net_connections()
+        if listener_filter is None
+        or listener_filter.wants_socket(conn.family, conn.type, conn.laddr)
+    ]
+
+
+class ListenerFilter:
+    """
+    Decides which listening sockets to list. Everything that can be decided
+    from the socket itself is checked before its owner is looked up, and the
+    owner's pid and user are checked before any other details of the
+    process are read. An empty list (or None) means no filtering.
+    """
+
+    LOCALHOST = ("127.0.0.1", "::1")
+
+    def __init__(
+        self,
+        protos=None,
+        public=False,
+        ports=None,
+        port_ranges=None,
+        networks=None,
+        pids=None,
+        uids=None,
+    ):
+        self.protos = protos
+        self.public = public
+        self.ports = set(ports or [])
+        self.port_ranges = port_ranges or []
+        self.networks = networks
+        self.pids = set(pids or [])
+        self.uids = set(uids or [])
+
+    def wants_socket(self, family, type_, laddr):
+        host, port = laddr[0], laddr[1]
+        if self.protos and proto_name(family, type_) not in self.protos:
+            return False
+        if self.public and host in self.LOCALHOST:
+            return False
+        if (self.ports or self.port_ranges) and not (
+            port in self.ports or any(lo <= port <= hi for lo, hi in self.port_ranges)
+        ):
+            return False
+        if self.networks:
+            ip = ipaddress.ip_address(host.split("%")[0])  # drop ipv6 zone
+            if not any(ip in network for network in self.networks):
+                return False
+        return True
+
+    def wants_process(self, pid):
+        """
+        Checks `pid` (None if the owner is unknown). Only reads the
+        process's uids, and only when filtering by user.
+        """
+        if self.pids and pid not in self.pids:
+            return False
+        if self.uids:
+            try:
+                if not pid or psutil.Process(pid).uids().real not in self.uids:
+                    return False
+            except psutil.NoSuchProcess:
+                return False
+        return True
+
+
+PROCESS_ATTRS = [
+    "cmdline",
+    "username",
+    "ppid",
+    "nice",
+    "cpu_percent",
+    "memory_percent",
+    "num_threads",
+    "create_time",
+]
+
+
+def process_info(pid, proc_infos=None):
+    """
+    Returns a dict with keys 'cmdline', 'username', 'ppid', 'nice',
+    'cpu_percent', 'memory_percent', 'num_threads', 'started' for process
+    `pid`, reading everything in one batch. Keys whose values are not
+    accessible are left out, and if the process has gone away the dict is
+    empty.
+
+    If `proc_infos` is given, it is used as a cache keyed by
+    (pid, create_time), so a process is only read again if the pid has
+    been reused.
+    """
+    try:
+        proc = psutil.Process(pid)
+        key = pid, proc.create_time()
+        if proc_infos is not None and key in proc_infos:
+            return proc_infos[key]
+        # as_dict() reads all the attributes inside Process.oneshot()
+        info = proc.as_dict(attrs=PROCESS_ATTRS, ad_value=None)
+    except psutil.NoSuchProcess:
+        return {}
+
+    create_time = info.pop("create_time")
+    if create_time is not None:
+        info["started"] = datetime.datetime.utcfromtimestamp(create_time)
+    if info["cmdline"] is not None:
+        info["cmdline"] = subprocess.list2cmdline(info["cmdline"])
+    info = {k: v for k, v in info.items() if v is not None}
+    if proc_infos is not None:
+        proc_infos[key] = info
+    return info
+
+
+def sample_cpu_percent(pids, interval):
+    """
+    Returns a dict mapping each pid in `pids` to its cpu_percent over a
+    single `interval` seconds shared by all of them. Processes that exit or
+    deny access are left out.
+    """
+    procs = []
+    for pid in pids:
+        try:
+            proc = psutil.Process(pid)
+            proc.cpu_percent()  # first call only records the cpu times
+            procs.append(proc)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+
+    time.sleep(interval)
+
+    cpu_percents = {}
+    for proc in procs:
+        try:
+            cpu_percents[proc.pid] = proc.cpu_percent()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return cpu_percents
+
+
+def iter_info(backend=None, owner_index=None, proc_infos=None, listener_filter=None):
+    """
+    Yields dicts with keys 'proto', 'host', 'port', 'pid', 'cmdline',
+    'username', 'ppid', 'nice', 'cpu_percent', 'memory_percent',
+    'num_threads', 'started', for the sockets found by
+    `listening_connections(backend, owner_index)`, each one as soon as its
+    process details have been read.
+
+    `proc_infos` is the `process_info()` cache to carry over from a previous
+    call, if any. Once the generator is exhausted, processes that no longer
+    own listening sockets have been dropped from it.
+
+    `listener_filter` is a `ListenerFilter`, applied before any process
+    details are read.
     """
-    entries = []
     uniques = set()
-    for netcon in psutil.net_connections():
+    infos_by_pid = {}  # shared by all of a process's sockets
+    for netcon in listening_connections(backend, owner_index, listener_filter):
         if not netcon.raddr and netcon.laddr[1] > 0:
             # avoid duplicate listing of the same pid+proto+address which
             # can happen if a file descriptor has been dupped or something
@@ -45,42 +599,52 @@ def gather_info():
 
             entry = {
                 "netcon": netcon,
+                "proto": proto_name(netcon.family, netcon.type),
                 "host": netcon.laddr[0],
                 "port": netcon.laddr[1],
                 "pid": netcon.pid,
             }
-
-            if netcon.family == AddressFamily.AF_INET:
-                if netcon.type == SocketKind.SOCK_DGRAM:
-                    entry["proto"] = "UDP4"
-                elif netcon.type == SocketKind.SOCK_STREAM:
-                    entry["proto"] = "TCP4"
-                else:
-                    continue  # log something?
-            elif netcon.family == AddressFamily.AF_INET6:
-                if netcon.type == SocketKind.SOCK_DGRAM:
-                    entry["proto"] = "UDP6"
-                elif netcon.type == SocketKind.SOCK_STREAM:
-                    entry["proto"] = "TCP6"
-                else:
-                    continue  # log something?
-            else:
+            if not entry["proto"]:
                 continue  # log something?
+            if listener_filter and not listener_filter.wants_process(entry["pid"]):
+                continue
 
             if entry["pid"]:
-                proc = psutil.Process(entry["pid"])
-                entry["cmdline"] = subprocess.list2cmdline(proc.cmdline())
-                entry["username"] = proc.username()
-                entry["ppid"] = proc.ppid()
-                entry["nice"] = proc.nice()
-                entry["cpu_percent"] = proc.cpu_percent()
-                entry["memory_percent"] = proc.memory_percent()
-                entry["num_threads"] = proc.num_threads()
-                entry["started"] = datetime.datetime.utcfromtimestamp(
-                    proc.create_time()
-                )
+                if entry["pid"] not in infos_by_pid:
+                    infos_by_pid[entry["pid"]] = process_info(entry["pid"], proc_infos)
+                entry.update(infos_by_pid[entry["pid"]])
+
+            yield entry
+
+    if proc_infos is not None:
+        for key in list(proc_infos):
+            if key[0] not in infos_by_pid:
+                del proc_infos[key]
 
-            entries.append(entry)
+
+def gather_info(
+    backend=None,
+    owner_index=None,
+    proc_infos=None,
+    listener_filter=None,
+    sample_interval=None,
+):
+    """
+    Returns a list of the dicts yielded by
+    `iter_info(backend, owner_index, proc_infos, listener_filter)`.
+
+    If `sample_interval` is given, 'cpu_percent' is measured over that many
+    seconds (once for all processes) instead of being the meaningless first
+    reading.
+    """
+    entries = list(iter_info(backend, owner_index, proc_infos, listener_filter))
+
+    if sample_interval:
+        pids = {entry["pid"] for entry in entries if entry["pid"]}
+        cpu_percents = sample_cpu_percent(pids, sample_interval)
+        for entry in entries:
+            if entry["pid"] in cpu_percents:
+                entry["cpu_percent"] = cpu_percents[entry["pid"]]
 
     return entries
 
@@ -139,6 +703,139 @@ def print_table(entries):
         )
 
 
+RECORD_FIELDS = [
+    "proto",
+    "host",
+    "port",
+    "pid",
+    "username",
+    "ppid",
+    "nice",
+    "cpu_percent",
+    "memory_percent",
+    "num_threads",
+    "started",
+    "cmdline",
+]
+
+
+def to_record(entry):
+    """
+    Returns a dict of the RECORD_FIELDS of `entry`, with None for anything
+    unknown and 'started' as an ISO 8601 timestamp.
+    """
+    record = {field: entry.get(field) for field in RECORD_FIELDS}
+    if record["started"] is not None:
+        record["started"] = (
+            record["started"].replace(tzinfo=datetime.timezone.utc).isoformat()
+        )
+    return record
+
+
+def write_jsonl(entries, out=None):
+    """
+    Writes each entry as a line of json to `out` (default: stdout) as soon
+    as it comes out of `entries`.
+    """
+    out = out or sys.stdout
+    for entry in entries:
+        out.write(json.dumps(to_record(entry)) + "\n")
+        out.flush()
+
+
+def write_csv(entries, out=None):
+    """
+    Writes a header row then a row for each entry to `out` (default:
+    stdout) as soon as it comes out of `entries`. Unknown values are empty.
+    """
+    out = out or sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(RECORD_FIELDS)
+    for entry in entries:
+        record = to_record(entry)
+        writer.writerow(["" if v is None else v for v in record.values()])
+        out.flush()
+
+
+def listener_id(entry):
+    return entry["proto"], entry["host"], entry["port"], entry["pid"]
+
+
+def listener_sort_key(entry):
+    return entry["port"], entry["proto"], entry["host"], entry["pid"] or 0
+
+
+def print_change(change, entry):
+    print(
+        "{:%Y-%m-%d %H:%M:%S} {} {:>5} {} {:>5} {:>5} {}".format(
+            datetime.datetime.now(),
+            change,
+            entry["proto"],
+            entry["host"],
+            entry["port"],
+            entry["pid"] or "?",
+            entry.get("cmdline", "?"),
+        )
+    )
+
+
+def watch(interval, backend=None, listener_filter=None):
+    """
+    Prints the table of listening sockets that pass `listener_filter`,
+    then every `interval` seconds prints the ones that have been added (+)
+    or removed (-) since the previous tick. The socket owner index and
+    process info are kept from tick to tick, so each tick only does work
+    for processes that are new.
+    """
+    owner_index = SocketOwnerIndex(pids=listener_filter and listener_filter.pids)
+    proc_infos = {}
+    last = None
+    next_due = time.monotonic()
+    while True:
+        entries = {
+            listener_id(entry): entry
+            for entry in gather_info(backend, owner_index, proc_infos, listener_filter)
+        }
+        if last is None:
+            print_table(entries.values())
+        else:
+            removed = [last[k] for k in last.keys() - entries.keys()]
+            added = [entries[k] for k in entries.keys() - last.keys()]
+            for entry in sorted(removed, key=listener_sort_key):
+                print_change("-", entry)
+            for entry in sorted(added, key=listener_sort_key):
+                print_change("+", entry)
+        sys.stdout.flush()
+        last = entries
+
+        next_due += interval
+        time.sleep(max(0, next_due - time.monotonic()))
+
+
+def parse_network(value):
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_port_range(value):
+    try:
+        lo, hi = (int(port) for port in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected LO-HI, got %r" % value)
+    return lo, hi
+
+
+def parse_user(value):
+    if value.isdigit():
+        return int(value)
+    try:
+        return pwd.getpwnam(value).pw_uid
+    except KeyError:
+        raise argparse.ArgumentTypeError("no such user %r" % value)
+
+
 def main(argv=None):
     argv = argv or sys.argv
 
@@ -155,6 +852,49 @@ def main(argv=None):
         action="store_true",
         help="do not list sockets listening on localhost",
     )
+    other_group.add_argument(
+        "--host",
+        dest="networks",
+        metavar="CIDR",
+        action="append",
+        type=parse_network,
+        help="list sockets listening on an address in CIDR (e.g. 10.0.0.0/8)",
+    )
+    other_group.add_argument(
+        "-p",
+        "--port",
+        dest="ports",
+        metavar="PORT",
+        action="append",
+        type=int,
+        help="list sockets listening on PORT",
+    )
+    other_group.add_argument(
+        "--port-range",
+        dest="port_ranges",
+        metavar="LO-HI",
+        action="append",
+        type=parse_port_range,
+        help="list sockets listening on a port from LO to HI inclusive",
+    )
+
+    proc_group = arg_parser.add_argument_group(title="filter by process")
+    proc_group.add_argument(
+        "--pid",
+        dest="pids",
+        action="append",
+        type=int,
+        help="list sockets owned by process PID",
+    )
+    proc_group.add_argument(
+        "-u",
+        "--user",
+        dest="uids",
+        metavar="USER",
+        action="append",
+        type=parse_user,
+        help="list sockets owned by processes of USER (name or uid)",
+    )
 
     proto_group = arg_parser.add_argument_group(
         title="filter by protocol",
@@ -192,25 +932,106 @@ def main(argv=None):
         help="list processes listening on IPv6 UDP",
     )
 
+    arg_parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        help=(
+            "how to enumerate listening sockets (default: netlink on linux, "
+            "falling back to procfs and then psutil if unavailable)"
+        ),
+    )
+
+    arg_parser.add_argument(
+        "-f",
+        "--format",
+        choices=["table", "jsonl", "csv"],
+        default="table",
+        help=(
+            "output format; jsonl and csv are written a row at a time, "
+            "unsorted, as each listening socket is resolved (default: table)"
+        ),
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--watch",
+        metavar="INTERVAL",
+        type=float,
+        help=(
+            "keep running, and every INTERVAL seconds print the listening "
+            "sockets that have been added (+) or removed (-)"
+        ),
+    )
+
+    arg_parser.add_argument(
+        "-i",
+        "--sample-interval",
+        metavar="SECONDS",
+        type=float,
+        help=(
+            "measure %%CPU over SECONDS (one interval for all processes); "
+            "without this %%CPU is not meaningful"
+        ),
+    )
+
     args = arg_parser.parse_args(args=argv[1:])
+    if args.watch and args.format != "table":
+        arg_parser.error("--watch only prints tables, not --format %s" % args.format)
+    if args.watch and args.sample_interval:
+        arg_parser.error("--watch can't be combined with --sample-interval")
+
+    listener_filter = ListenerFilter(
+        protos=args.protos,
+        public=args.public,
+        ports=args.ports,
+        port_ranges=args.port_ranges,
+        networks=args.networks,
+        pids=args.pids,
+        uids=args.uids,
+    )
 
     try:
-        all_entries = gather_info()
-        entries = [
-            entry
-            for entry in all_entries
-            if (not args.protos or entry["proto"] in args.protos)
-            and (not args.public or not entry["host"] in ("127.0.0.1", "::1"))
-        ]
-        print_table(entries)
+        if args.watch:
+            watch(args.watch, args.backend, listener_filter)
+        elif args.format == "table":
+            print_table(
+                gather_info(
+                    args.backend,
+                    listener_filter=listener_filter,
+                    sample_interval=args.sample_interval,
+                )
+            )
+        else:
+            if args.sample_interval:
+                entries = gather_info(
+                    args.backend,
+                    listener_filter=listener_filter,
+                    sample_interval=args.sample_interval,
+                )
+            else:
+                entries = iter_info(args.backend, listener_filter=listener_filter)
+            if args.format == "jsonl":
+                write_jsonl(entries)
+            else:
+                write_csv(entries)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # the reader went away (e.g. `pslisten -f jsonl | head`); point
+        # stdout at /dev/null so that flushing it at exit doesn't complain
+        # again
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
     finally:
         if os.getuid() != 0:
-            print()
+            # keep machine-readable output clean
+            out = sys.stdout if args.format == "table" else sys.stderr
+            print(file=out)
             print(
                 "*** warning: you must run %s as root to see all available "
-                "information ***" % os.path.basename(argv[0])
+                "information ***" % os.path.basename(argv[0]),
+                file=out,
             )
-            print()
+            print(file=out)
 
 
 if __name__ == "__main__":
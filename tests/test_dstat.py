@@ -0,0 +1,142 @@
+import os
+
+import psutil
+import pytest
+
+from psutilz import dstat
+from psutilz.dstat import Cell, CollectorSpec, Dstat, ProcfsSources, Sampler
+
+NET_DEV_HEADER = (
+    "Inter-|   Receive                                                |  Transmit\n"
+    " face |bytes    packets errs drop fifo frame compressed multicast"
+    "|bytes    packets errs drop fifo colls carrier compressed\n"
+)
+
+
+def fake_procfs(path, nics=(), disks=()):
+    """
+    Writes a fake /proc and /sys under `path`, with `nics` in net/dev and
+    `disks` (all whole disks) in diskstats, each of them counting its index
+    plus one in every counter. Returns (procfs, sysfs).
+    """
+    procfs, sysfs = path / "proc", path / "sys"
+    (procfs / "net").mkdir(parents=True)
+    (sysfs / "block").mkdir(parents=True)
+    (procfs / "stat").write_text("cpu  1 2 3 4 5 6 7 8 9 10\nctxt 11\n")
+    (procfs / "meminfo").write_text("MemTotal: 100 kB\nMemAvailable: 40 kB\n")
+    (procfs / "vmstat").write_text("pswpin 1\npswpout 2\n")
+    (procfs / "net" / "dev").write_text(
+        NET_DEV_HEADER
+        + "".join(
+            "%6s: %s\n" % (nic, " ".join([str(i + 1)] * 16))
+            for i, nic in enumerate(nics)
+        )
+    )
+    (procfs / "diskstats").write_text(
+        "".join(
+            "   8       %d %s %s\n" % (i, disk, " ".join([str(i + 1)] * 17))
+            for i, disk in enumerate(disks)
+        )
+    )
+    for disk in disks:
+        (sysfs / "block" / disk).mkdir()
+    return str(procfs), str(sysfs)
+
+
+@pytest.fixture
+def short_reads(monkeypatch):
+    """
+    Makes os.preadv() return at most about a page of whole lines per call,
+    like seq_file based files such as /proc/net/dev.
+    """
+
+    def short_preadv(fd, buffers, offset):
+        (buf,) = buffers
+        chunk = os.pread(fd, min(len(buf), 4096), offset)
+        if len(chunk) == 4096 and b"\n" in chunk:
+            chunk = chunk[: chunk.rindex(b"\n") + 1]
+        buf[: len(chunk)] = chunk
+        return len(chunk)
+
+    monkeypatch.setattr(os, "preadv", short_preadv)
+
+
+def test_procfs_reads_files_past_short_reads(tmp_path, short_reads):
+    nics = ["veth%d" % i for i in range(300)]
+    disks = ["nvme%dn1" % i for i in range(300)]
+    procfs, sysfs = fake_procfs(tmp_path, nics, disks)
+    assert os.path.getsize(os.path.join(procfs, "net", "dev")) > 3 * 4096
+    sources = ProcfsSources(procfs, sysfs)
+
+    names, counters = sources.pernic_io()
+    assert names == tuple(nics)
+    assert list(counters) == [i + 1 for i in range(300) for _ in range(2)]
+    assert sources.net_io() == (45150, 45150)
+
+    names, counters = sources.perdisk_io()
+    assert names == tuple(disks)
+    assert list(counters) == [(i + 1) * 512 for i in range(300) for _ in range(2)]
+    assert sources.disk_io() == (45150 * 512, 45150 * 512)
+
+
+def test_procfs_not_available_without_sys_block(tmp_path):
+    procfs, sysfs = fake_procfs(tmp_path, ["eth0"], ["sda"])
+    assert ProcfsSources.available(procfs, sysfs) == psutil.LINUX
+    assert not ProcfsSources.available(procfs, str(tmp_path / "nosys"))
+
+
+@pytest.mark.skipif(not ProcfsSources.available(), reason="needs linux /proc")
+def test_procfs_devices_match_psutil():
+    sources = ProcfsSources()
+    assert set(sources.pernic_io()[0]) == set(psutil.net_io_counters(pernic=True))
+    assert set(sources.perdisk_io()[0]) == set(psutil.disk_io_counters(perdisk=True))
+
+
+def read_queue_depth():
+    return (7,)
+
+
+class QueueDepth:
+    """
+    A plugin collector with a source of its own.
+    """
+
+    sources = (read_queue_depth, "loadavg")
+    cells = (Cell(5),)
+
+    def header0(self):
+        return "queue"
+
+    def header1(self):
+        return ("depth",)
+
+    def value(self, snapshot, last):
+        return snapshot[read_queue_depth]
+
+
+def test_sampler_reads_function_sources():
+    snapshot = Sampler([read_queue_depth, "loadavg", read_queue_depth]).sample()
+    assert snapshot[read_queue_depth] == (7,)
+    assert len(snapshot["loadavg"]) == 3
+
+
+def test_sampler_unknown_source():
+    with pytest.raises(ValueError, match="unknown source 'gpu'"):
+        Sampler(["gpu"])
+
+
+def test_plugin_with_own_source(capsys):
+    dstat = Dstat([QueueDepth()], color=False)
+    dstat.print_stats_line(0)
+    assert capsys.readouterr().out == "    7\n"
+
+
+def test_plugin_with_unknown_source(monkeypatch, capsys):
+    class Gpu(QueueDepth):
+        sources = ("gpu",)
+
+    plugins = {"gpu": CollectorSpec(("--gpu",), "gpu", lambda _: [Gpu()])}
+    monkeypatch.setattr(dstat, "plugin_collectors", lambda: plugins)
+    with pytest.raises(SystemExit):
+        dstat.main(["dstat.py", "--gpu", "1", "1"])
+    assert "collector gpu needs unknown source 'gpu'" in capsys.readouterr().err
@@ -0,0 +1,177 @@
+import io
+from array import array
+
+import psutil
+import pytest
+
+from psutilz.ps import (
+    LiveProcessTree,
+    ProcInfo,
+    break_cycles,
+    build_process_tree,
+    main,
+    print_tree,
+)
+
+
+def procs(ppids):
+    """
+    Makes a synthetic process table from {pid: ppid}.
+    """
+    return [ProcInfo(pid, {"pid": pid, "ppid": ppid}) for pid, ppid in ppids.items()]
+
+
+def shape(tree):
+    """
+    Returns the tree as a list of (pid, depth) in walk order.
+    """
+    return [(proc.pid, depth) for proc, depth in tree.walk()]
+
+
+def test_build_process_tree():
+    tree = build_process_tree(procs({1: 0, 2: 1, 3: 1, 4: 2}))
+    assert shape(tree) == [(1, 0), (2, 1), (4, 2), (3, 1)]
+
+
+def test_children_in_pid_order():
+    tree = build_process_tree(procs({1: 0, 30: 1, 10: 1, 20: 1}))
+    assert shape(tree) == [(1, 0), (10, 1), (20, 1), (30, 1)]
+
+
+def test_missing_parent():
+    # 5's parent exited between reading the process table and its ppid
+    tree = build_process_tree(procs({1: 0, 2: 1, 5: 99, 6: 5}))
+    assert shape(tree) == [(1, 0), (2, 1), (5, 0), (6, 1)]
+
+
+def test_unreadable_ppid():
+    # ppid is None when it couldn't be read (process gone, access denied)
+    tree = build_process_tree(procs({1: 0, 2: 1, 3: None, 4: 3}))
+    assert shape(tree) == [(1, 0), (2, 1), (3, 0), (4, 1)]
+
+
+def test_own_parent():
+    # on macOS kernel_task is pid 0 with ppid 0, and launchd's ppid is 0
+    tree = build_process_tree(procs({0: 0, 1: 0, 2: 1}))
+    assert shape(tree) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_pid_reuse_cycle():
+    # 3's parent 2 exited and its pid went to 4, a descendant of 3
+    tree = build_process_tree(procs({1: 0, 2: 4, 3: 2, 4: 3, 5: 4}))
+    assert shape(tree) == [(1, 0), (2, 0), (3, 1), (4, 2), (5, 3)]
+
+
+def test_every_process_once():
+    table = procs({1: 0, 2: 3, 3: 2, 4: 4, 5: 6, 6: 7, 7: 5, 8: None, 9: 42})
+    tree = build_process_tree(table)
+    assert sorted(pid for pid, _ in shape(tree)) == [p.pid for p in table]
+
+
+def test_break_cycles():
+    parents = array("i", [-1, 2, 3, 1, 0, 4])  # 1 -> 2 -> 3 -> 1
+    break_cycles(parents)
+    assert list(parents) == [-1, -1, 3, 1, 0, 4]
+
+
+def test_break_cycles_self_loop_and_separate_cycles():
+    parents = array("i", [0, 2, 1, 4, 3])
+    break_cycles(parents)
+    assert list(parents) == [-1, -1, 1, -1, 3]
+
+
+def test_break_cycles_leaves_trees_alone():
+    parents = array("i", [-1, 0, 0, 1, 3, -1, 5])
+    break_cycles(parents)
+    assert list(parents) == [-1, 0, 0, 1, 3, -1, 5]
+
+
+class FakeProcess:
+    """
+    Stands in for `psutil.Process`, for the processes in `table`.
+    """
+
+    table = {}  # pid -> ppid
+
+    def __init__(self, pid):
+        if pid not in self.table:
+            raise psutil.NoSuchProcess(pid)
+        self.pid = pid
+
+    def ppid(self):
+        if self.pid not in self.table:
+            raise psutil.NoSuchProcess(self.pid)
+        return self.table[self.pid]
+
+    def as_dict(self, attrs, ad_value=None):
+        return {attr: self.ppid() if attr == "ppid" else ad_value for attr in attrs}
+
+    def is_running(self):
+        return self.pid in self.table
+
+
+@pytest.fixture
+def live_tree(monkeypatch):
+    """
+    Returns a function that makes the process table {pid: ppid} current and
+    returns an updated `LiveProcessTree`.
+    """
+    tree = LiveProcessTree(["pid", "ppid"])
+    monkeypatch.setattr(psutil, "Process", FakeProcess)
+    monkeypatch.setattr(psutil, "pids", lambda: sorted(FakeProcess.table))
+
+    def update(table):
+        FakeProcess.table = table
+        tree.update()
+        return [(proc.pid, depth) for proc, depth in tree.walk()]
+
+    return update
+
+
+def test_live_tree(live_tree):
+    assert live_tree({1: 0, 2: 1, 3: 2}) == [(1, 0), (2, 1), (3, 2)]
+    # 2 exits and 3 is reparented to 1
+    assert live_tree({1: 0, 3: 1, 4: 1}) == [(1, 0), (3, 1), (4, 1)]
+
+
+def test_live_tree_own_parent(live_tree):
+    # macOS: kernel_task is pid 0 with ppid 0, and launchd's ppid is 0
+    assert live_tree({0: 0, 1: 0, 2: 1}) == [(0, 0), (1, 1), (2, 2)]
+    assert live_tree({0: 0, 1: 0, 2: 1, 3: 3}) == [(0, 0), (1, 1), (2, 2), (3, 0)]
+
+
+def test_live_tree_pid_reuse_cycle(live_tree):
+    # all born in one tick, with 2's pid reused by a descendant of its child
+    walk = live_tree({1: 0, 2: 4, 3: 2, 4: 3})
+    assert sorted(pid for pid, _ in walk) == [1, 2, 3, 4]
+    assert [pid for pid, depth in walk if depth == 0][0] == 1
+
+
+def test_live_tree_orphan_cycle(live_tree):
+    live_tree({1: 0, 2: 1, 3: 2, 4: 3})
+    # 2 exits, and 3 is reparented to what now reads as its own child
+    assert live_tree({1: 0, 3: 4, 4: 3}) == [(1, 0), (3, 0), (4, 1)]
+
+
+@pytest.mark.parametrize("args", [["-s", "cpu"], ["-k", "3", "-s", "cpu"]])
+def test_cpu_sort_requires_interval(args, capsys):
+    with pytest.raises(SystemExit):
+        main(["ps.py", *args])
+    assert "requires --interval" in capsys.readouterr().err
+
+
+def test_print_tree_max_width():
+    cmdline = ["sh", "-c", "echo a\nsleep " + "9" * 100]
+    tree = build_process_tree(
+        [
+            ProcInfo(1, {"pid": 1, "ppid": 0, "cmdline": cmdline, "name": "sh"}),
+            ProcInfo(2, {"pid": 2, "ppid": 1, "cmdline": None, "name": "x"}),
+        ]
+    )
+    out = io.StringIO()
+    print_tree(tree, ["pid", "cmd"], out=out, max_width=24)
+    assert out.getvalue().splitlines() == [
+        "  PID COMMAND",
+        '    1 sh -c "echo a slee',
+        "    2   x",
+    ]
@@ -0,0 +1,242 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from collections import namedtuple
+
+import psutil
+import pytest
+
+from psutilz.pslisten import (
+    PF_KTHREAD,
+    ListenerFilter,
+    SocketOwnerIndex,
+    addr,
+    iter_info,
+    sconn,
+    write_csv,
+    write_jsonl,
+)
+
+
+def fake_process(procfs, pid, ppid=1, starttime=100, sockets=(), flags=0):
+    """
+    Adds process `pid` to the fake /proc at `procfs`, with fds 3, 4, ...
+    open on the socket inodes `sockets`.
+    """
+    proc_dir = procfs / str(pid)
+    (proc_dir / "fd").mkdir(parents=True)
+    # fields after the comm: state ppid pgrp session tty_nr tpgid flags ...
+    fields = ["S", ppid] + [0] * 4 + [flags] + [0] * 12 + [starttime]
+    stat = "%s (fake %s) %s\n" % (pid, pid, " ".join(str(f) for f in fields))
+    (proc_dir / "stat").write_text(stat)
+    for fd, inode in enumerate(sockets, 3):
+        os.symlink("socket:[%s]" % inode, proc_dir / "fd" / str(fd))
+
+
+def test_find_owners(tmp_path):
+    fake_process(tmp_path, 1, ppid=0)
+    fake_process(tmp_path, 10, sockets=[1000, 1001])
+    fake_process(tmp_path, 20, sockets=[2000])
+    fake_process(tmp_path, 2, ppid=0, flags=PF_KTHREAD, sockets=[3000])
+    index = SocketOwnerIndex(str(tmp_path))
+    owners = index.find_owners({1000, 2000, 3000})
+    assert owners == {1000: [(10, 3)], 2000: [(20, 3)]}
+
+
+def test_find_owners_shared_socket_is_stable(tmp_path):
+    # a listener inherited by two forked children, plus a socket of the
+    # second child that makes it get scanned
+    fake_process(tmp_path, 1, ppid=0)
+    fake_process(tmp_path, 10, sockets=[1000])
+    fake_process(tmp_path, 11, ppid=10, sockets=[1000])
+    fake_process(tmp_path, 12, ppid=10, sockets=[1000, 1200])
+    index = SocketOwnerIndex(str(tmp_path))
+    first = index.find_owners({1000, 1200})
+    assert first == {1000: [(10, 3)], 1200: [(12, 4)]}
+    for _ in range(3):
+        assert index.find_owners({1000, 1200}) == first
+
+
+def test_find_owners_owner_exits(tmp_path):
+    fake_process(tmp_path, 1, ppid=0)
+    fake_process(tmp_path, 10, sockets=[1000])
+    fake_process(tmp_path, 11, ppid=10, sockets=[1000])
+    index = SocketOwnerIndex(str(tmp_path))
+    assert index.find_owners({1000}) == {1000: [(10, 3)]}
+    os.unlink(tmp_path / "10" / "fd" / "3")
+    os.unlink(tmp_path / "10" / "stat")
+    os.rmdir(tmp_path / "10" / "fd")
+    os.rmdir(tmp_path / "10")
+    assert index.find_owners({1000}) == {1000: [(11, 3)]}
+
+
+def count_calls(monkeypatch, index, method):
+    calls = []
+    original = getattr(index, method)
+
+    def counted(pid):
+        calls.append(pid)
+        return original(pid)
+
+    monkeypatch.setattr(index, method, counted)
+    return calls
+
+
+def test_find_owners_only_does_work_for_churn(tmp_path, monkeypatch):
+    fake_process(tmp_path, 1, ppid=0)
+    for pid in range(10, 20):
+        fake_process(tmp_path, pid, sockets=[pid * 100])
+    index = SocketOwnerIndex(str(tmp_path))
+    # 9999 is owned by no process we can see, like a kernel socket
+    inodes = {1000, 9999}
+    assert index.find_owners(inodes) == {1000: [(10, 3)]}
+
+    stats = count_calls(monkeypatch, index, "_read_stat")
+    scans = count_calls(monkeypatch, index, "_scan_fds")
+    for _ in range(3):
+        assert index.find_owners(inodes) == {1000: [(10, 3)]}
+    assert stats == [] and scans == []
+
+    # a new process is read and scanned once, for the ownerless socket
+    fake_process(tmp_path, 30, sockets=[3000])
+    assert index.find_owners(inodes) == {1000: [(10, 3)]}
+    assert index.find_owners(inodes) == {1000: [(10, 3)]}
+    assert stats == [30] and scans == [30]
+
+    # a socket not seen before is looked for in everything once
+    assert index.find_owners(inodes | {1500}) == {1000: [(10, 3)], 1500: [(15, 3)]}
+    assert set(scans) == {1, 30} | set(range(10, 16))
+
+
+def test_find_owners_keeps_only_owners_of_listeners(tmp_path):
+    fake_process(tmp_path, 1, ppid=0)
+    # lots of established sockets, of which one is looked up
+    fake_process(tmp_path, 10, sockets=range(1000, 1100))
+    fake_process(tmp_path, 20, ppid=0, sockets=range(2000, 2100))
+    index = SocketOwnerIndex(str(tmp_path))
+    assert index.find_owners({1050, 9999}) == {1050: [(10, 53)]}
+    assert index.owners == {1050: (10, 100, 53)}
+    assert index.ownerless == {9999}
+    assert index.scanned == {1, 10, 20}
+
+
+def test_find_owners_pid_reuse(tmp_path):
+    fake_process(tmp_path, 1, ppid=0)
+    fake_process(tmp_path, 10, starttime=100, sockets=[1000])
+    index = SocketOwnerIndex(str(tmp_path))
+    assert index.find_owners({1000}) == {1000: [(10, 3)]}
+    # pid 10 exits and is reused by a process with another socket on fd 3
+    for name in ["fd/3", "fd", "stat"]:
+        path = tmp_path / "10" / name
+        os.rmdir(path) if path.is_dir() and not path.is_symlink() else os.unlink(path)
+    os.rmdir(tmp_path / "10")
+    fake_process(tmp_path, 10, starttime=200, sockets=[2000])
+    assert index.find_owners({1000, 2000}) == {2000: [(10, 3)]}
+
+
+def test_find_owners_only_scans_given_pids(tmp_path, monkeypatch):
+    fake_process(tmp_path, 1, ppid=0)
+    fake_process(tmp_path, 10, sockets=[1000])
+    fake_process(tmp_path, 11, ppid=10, sockets=[1000])
+    fake_process(tmp_path, 20, sockets=[2000])
+    index = SocketOwnerIndex(str(tmp_path), pids=[11])
+    stats = count_calls(monkeypatch, index, "_read_stat")
+    scans = count_calls(monkeypatch, index, "_scan_fds")
+    assert index.find_owners({1000, 2000}) == {1000: [(11, 3)]}
+    assert stats == [11] and scans == [11]
+
+
+puids = namedtuple("puids", ["real", "effective", "saved"])
+
+LISTENERS = [
+    sconn(3, socket.AF_INET, socket.SOCK_STREAM, addr("0.0.0.0", 22), (), "LISTEN", 10),
+    sconn(
+        4, socket.AF_INET, socket.SOCK_STREAM, addr("127.0.0.1", 25), (), "LISTEN", 20
+    ),
+    sconn(5, socket.AF_INET6, socket.SOCK_DGRAM, addr("::", 53), (), "NONE", 30),
+    sconn(6, socket.AF_INET, socket.SOCK_STREAM, addr("0.0.0.0", 80), (), "LISTEN", 40),
+]
+
+
+@pytest.fixture
+def processes_read(monkeypatch):
+    """
+    Lists the pids that `psutil.Process` is used on, with `LISTENERS` as
+    the listening sockets and every process owned by uid 1000 but pid 40
+    (uid 0).
+    """
+    read = []
+
+    class Process:
+        def __init__(self, pid):
+            read.append(pid)
+            self.pid = pid
+
+        def uids(self):
+            uid = 0 if self.pid == 40 else 1000
+            return puids(uid, uid, uid)
+
+        def create_time(self):
+            return 0.0
+
+        def as_dict(self, attrs, ad_value=None):
+            return dict.fromkeys(attrs, ad_value)
+
+    monkeypatch.setattr(psutil, "Process", Process)
+    monkeypatch.setattr(psutil, "net_connections", lambda: list(LISTENERS))
+    return read
+
+
+def listed(listener_filter):
+    entries = iter_info("psutil", listener_filter=listener_filter)
+    return [entry["port"] for entry in entries]
+
+
+def test_unfiltered_reads_every_process(processes_read):
+    assert listed(ListenerFilter()) == [22, 25, 53, 80]
+    assert processes_read == [10, 20, 30, 40]
+
+
+@pytest.mark.parametrize(
+    "listener_filter, ports",
+    [
+        (ListenerFilter(protos=["UDP6"]), [53]),
+        (ListenerFilter(public=True), [22, 53, 80]),
+        (ListenerFilter(ports=[25, 80]), [25, 80]),
+        (ListenerFilter(port_ranges=[(20, 30)]), [22, 25]),
+        (ListenerFilter(pids=[20]), [25]),
+    ],
+)
+def test_filtered_out_processes_are_not_read(processes_read, listener_filter, ports):
+    assert listed(listener_filter) == ports
+    assert processes_read == [conn.pid for conn in LISTENERS if conn.laddr[1] in ports]
+
+
+def test_user_filter_only_reads_uids_of_others(processes_read):
+    assert listed(ListenerFilter(uids=[0], ports=[22, 80])) == [80]
+    # uids of 10 and 40, then the details of 40 only
+    assert processes_read == [10, 40, 40]
+
+
+def test_writers_default_to_current_stdout(capsys):
+    entry = {"proto": "TCP4", "host": "0.0.0.0", "port": 22, "pid": 10}
+    write_jsonl([entry])
+    assert json.loads(capsys.readouterr().out)["port"] == 22
+    write_csv([entry])
+    assert capsys.readouterr().out.splitlines()[1].startswith("TCP4,0.0.0.0,22,10,")
+
+
+@pytest.mark.parametrize("format", ["jsonl", "csv"])
+def test_closed_pipe_exits_cleanly(format):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "psutilz.pslisten", "-f", format],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    proc.stdout.close()  # like `| head -0`
+    stderr = proc.stderr.read()
+    assert proc.wait() == 0
+    assert b"Traceback" not in stderr